@@ -0,0 +1,215 @@
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlparse
+from urllib.request import urlopen
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'stocks_products.settings')
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+from django.db import connection, connections  # noqa: E402
+from rest_framework.pagination import Cursor, PageNumberPagination  # noqa: E402
+from rest_framework.test import APIRequestFactory  # noqa: E402
+
+from logistic.models import Product, Stock, StockProduct  # noqa: E402
+from logistic.pagination import IdCursorPagination  # noqa: E402
+from logistic.reservations import InsufficientStock, reserve  # noqa: E402
+from logistic.views import ProductViewSet  # noqa: E402
+
+PAGE_SIZE = 20
+PRODUCTS = 200_000
+REPEAT = 20
+
+
+def setup_database():
+    '''Отдельная база SQLite во временном каталоге, чтобы не трогать stock.db'''
+    settings.DATABASES['default']['NAME'] = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    # потоки бенчмарка резервов пишут в одну базу, SQLite сериализует записи блокировкой
+    settings.DATABASES['default']['OPTIONS'] = {'timeout': 30}
+    # замеряются запросы к базе, а не кэш ответов
+    settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+    settings.ALLOWED_HOSTS = ['*']
+    call_command('migrate', verbosity=0, run_syncdb=True)
+
+
+def fill_products(count=PRODUCTS):
+    Product.objects.bulk_create(
+        (Product(title=f'product {i}', description=f'description {i}') for i in range(count)),
+        batch_size=5000,
+    )
+
+
+def measure(view, params, repeat=REPEAT):
+    '''Медиана времени запроса в миллисекундах и число SQL-запросов'''
+    factory = APIRequestFactory()
+    timings = []
+    for _ in range(repeat):
+        request = factory.get('/api/v1/products/', params)
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = view(request)
+            response.render()
+            timings.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.data
+    return statistics.median(timings) * 1000, len(queries)
+
+
+class PagePagination(PageNumberPagination):
+    page_size = PAGE_SIZE
+
+
+def bench_pagination(deep_page=PRODUCTS // PAGE_SIZE):
+    '''Первая и глубокая страница списка продуктов: номер страницы (COUNT + OFFSET) против курсора по id'''
+    pages = PageNumberPagination.page_query_param
+    page_view = ProductViewSet.as_view({'get': 'list'}, pagination_class=PagePagination)
+    cursor_view = ProductViewSet.as_view({'get': 'list'}, pagination_class=IdCursorPagination)
+
+    # курсор на глубокую страницу строится так же, как его строит сама пагинация в ссылке next
+    paginator = IdCursorPagination()
+    paginator.base_url = 'http://testserver/api/v1/products/'
+    position = Product.objects.order_by('id').values_list('id', flat=True)[(deep_page - 1) * PAGE_SIZE - 1]
+    deep_link = paginator.encode_cursor(Cursor(offset=0, reverse=False, position=str(position)))
+    deep_cursor = parse_qs(urlparse(deep_link).query)[paginator.cursor_query_param][0]
+
+    cases = [
+        ('page 1', page_view, {pages: 1}),
+        (f'page {deep_page}', page_view, {pages: deep_page}),
+        ('cursor 1', cursor_view, {}),
+        (f'cursor {deep_page}', cursor_view, {paginator.cursor_query_param: deep_cursor}),
+        ('cursor 1 + estimate', cursor_view, {'count': 'estimate'}),
+    ]
+    for name, view, params in cases:
+        per_request, queries = measure(view, params)
+        print(f'{name:>20}: {per_request:7.2f} ms, {queries} queries')
+
+
+def reserve_read_modify_write(stock_id, product_id, quantity):
+    '''Прежний путь изменения остатка: прочитать позицию, проверить и сохранить'''
+    position = StockProduct.objects.get(stock_id=stock_id, product_id=product_id)
+    if position.quantity < quantity:
+        raise InsufficientStock()
+    position.quantity -= quantity
+    position.save(update_fields=['quantity'])
+
+
+def bench_reservations(initial=1000, orders=3000, threads=16):
+    '''orders параллельных резервов по 1 штуке при остатке initial: сколько прошло, сколько продано сверх остатка
+    и сколько обновлений потеряно. Правильный результат - ровно initial успешных резервов и остаток 0'''
+    product = Product.objects.create(title='reserved product')
+    for name, reserve_func in (('read-modify-write', reserve_read_modify_write), ('conditional F()', reserve)):
+        stock = Stock.objects.create(address=f'reservations {name}')
+        StockProduct.objects.create(stock=stock, product=product, quantity=initial, price=1)
+        lock = threading.Lock()
+        succeeded = 0
+
+        def one(_):
+            nonlocal succeeded
+            try:
+                reserve_func(stock.id, product.id, 1)
+            except InsufficientStock:
+                return
+            finally:
+                connections.close_all()
+            with lock:
+                succeeded += 1
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(threads) as executor:
+            list(executor.map(one, range(orders)))
+        elapsed = time.perf_counter() - start
+        left = StockProduct.objects.get(stock=stock, product=product).quantity
+        print(f'{name:>20}: {succeeded} reserved, {left} left, oversold {max(0, succeeded - initial)}, '
+              f'lost updates {succeeded - (initial - left)}, {orders / elapsed:.0f} orders/s')
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def process_status(pid: int) -> dict:
+    '''VmRSS (КиБ) и число потоков процесса из /proc, только Linux'''
+    status = {}
+    with open(f'/proc/{pid}/status') as file:
+        for line in file:
+            key, _, value = line.partition(':')
+            if key in ('VmRSS', 'Threads'):
+                status[key] = int(value.split()[0])
+    return status
+
+
+def load_server(command, url, requests=2000, concurrency=64):
+    '''Запускает сервер, дает requests запросов по url с concurrency одновременными клиентами.
+    Возвращает запросов в секунду, p95 в мс, пиковые RSS (МиБ) и число потоков сервера'''
+    env = dict(os.environ, DB_NAME=settings.DATABASES['default']['NAME'], LOGISTIC_CACHE_TIMEOUT='0')
+    server = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        for _ in range(100):
+            try:
+                urlopen(url).read()
+                break
+            except OSError:
+                time.sleep(0.1)
+        peak = {'VmRSS': 0, 'Threads': 0}
+        done = threading.Event()
+
+        def sample():
+            while not done.is_set():
+                for key, value in process_status(server.pid).items():
+                    peak[key] = max(peak[key], value)
+                time.sleep(0.02)
+
+        def one(_):
+            start = time.perf_counter()
+            urlopen(url).read()
+            return time.perf_counter() - start
+
+        sampler = threading.Thread(target=sample)
+        sampler.start()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            latencies = sorted(executor.map(one, range(requests)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        sampler.join()
+    finally:
+        server.terminate()
+        server.wait()
+    return requests / elapsed, latencies[int(len(latencies) * 0.95)] * 1000, peak['VmRSS'] / 1024, peak['Threads']
+
+
+def bench_servers(requests=2000, concurrency=64):
+    '''Список продуктов под нагрузкой: WSGI runserver (поток на запрос) против uvicorn с синхронным
+    DRF-представлением и с асинхронным (async_views). Нужен uvicorn'''
+    port = free_port()
+    wsgi = [sys.executable, 'manage.py', 'runserver', '--noreload', f'127.0.0.1:{port}']
+    asgi = [sys.executable, '-m', 'uvicorn', 'stocks_products.asgi:application', '--port', str(port),
+            '--log-level', 'warning']
+    cases = [
+        ('wsgi runserver', wsgi, '/api/v1/products/'),
+        ('asgi sync view', asgi, '/api/v1/products/'),
+        ('asgi async view', asgi, '/api/v1/async/products/'),
+    ]
+    for name, command, path in cases:
+        rps, p95, rss, threads = load_server(command, f'http://127.0.0.1:{port}{path}', requests, concurrency)
+        print(f'{name:>20}: {rps:7.0f} req/s, p95 {p95:7.1f} ms, peak RSS {rss:6.1f} MiB, {threads} threads')
+
+
+if __name__ == '__main__':
+    setup_database()
+    fill_products()
+    bench_pagination()
+    bench_reservations()
+    bench_servers()
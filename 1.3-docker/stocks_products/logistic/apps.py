@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class LogisticConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'logistic'
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+
+        from logistic import signals  # noqa: F401
+        from logistic.search import create_search_indexes
+
+        post_migrate.connect(create_search_indexes, sender=self)
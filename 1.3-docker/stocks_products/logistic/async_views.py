@@ -0,0 +1,61 @@
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+
+from logistic.models import Product, Stock
+from logistic.pagination import IdCursorPagination
+from logistic.serializers import ProductSerializer, StockSerializer
+from logistic.views import ProductViewSet, StockViewSet
+
+# Асинхронные list и retrieve для ASGI: строки читаются через async ORM (aiterator, aget), поток на запрос
+# не занимается. Ответы те же, что у ModelViewSet: те же сериализаторы, фильтры и поиск (filter_backends
+# представлений) и курсорная пагинация IdCursorPagination с ?cursor=. Кэш ответов и запись - только в синхронном API.
+
+
+def error(exc: APIException) -> JsonResponse:
+    # как exception_handler DRF: ошибки валидации отдаются как есть, остальные - в detail
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    return JsonResponse(data, status=exc.status_code, safe=False)
+
+
+async def list_response(request, viewset_class, serializer_class) -> JsonResponse:
+    request = Request(request)
+    view = viewset_class(request=request, format_kwarg=None, action='list', args=(), kwargs={})
+    paginator = IdCursorPagination()
+    try:
+        # фильтры могут проверять значения по базе (id продукта), поэтому строятся в синхронном потоке
+        queryset = await sync_to_async(view.filter_queryset)(view.get_queryset())
+        page = await paginator.apaginate_queryset(queryset, request)
+    except APIException as exc:
+        return error(exc)
+    return JsonResponse(paginator.get_paginated_data([serializer_class(obj).data for obj in page]))
+
+
+@require_GET
+async def product_list(request):
+    return await list_response(request, ProductViewSet, ProductSerializer)
+
+
+@require_GET
+async def product_detail(request, pk):
+    try:
+        product = await Product.objects.aget(pk=pk)
+    except Product.DoesNotExist:
+        return JsonResponse({'detail': 'No Product matches the given query.'}, status=404)
+    return JsonResponse(ProductSerializer(product).data)
+
+
+@require_GET
+async def stock_list(request):
+    return await list_response(request, StockViewSet, StockSerializer)
+
+
+@require_GET
+async def stock_detail(request, pk):
+    try:
+        stock = await Stock.objects.prefetch_related('positions').aget(pk=pk)
+    except Stock.DoesNotExist:
+        return JsonResponse({'detail': 'No Stock matches the given query.'}, status=404)
+    return JsonResponse(StockSerializer(stock).data)
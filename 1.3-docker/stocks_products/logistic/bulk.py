@@ -0,0 +1,193 @@
+import csv
+import itertools
+import json
+
+from django.conf import settings
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import UnsupportedMediaType, ValidationError
+
+from logistic.cache import invalidate_many
+from logistic.models import Product, Stock, StockProduct
+from logistic.serializers import PositionImportSerializer, ProductImportSerializer
+from logistic.totals import stock_positions_changed
+
+# строк на одну проверку, транзакцию и bulk_create при импорте
+IMPORT_CHUNK_SIZE = getattr(settings, 'LOGISTIC_IMPORT_CHUNK_SIZE', 1000)
+# строк, которые база отдает за раз при экспорте
+EXPORT_CHUNK_SIZE = getattr(settings, 'LOGISTIC_EXPORT_CHUNK_SIZE', 2000)
+# сколько ошибок строк возвращать в ответе импорта
+MAX_IMPORT_ERRORS = 100
+
+CSV_TYPES = {'text/csv'}
+NDJSON_TYPES = {'application/x-ndjson', 'application/jsonl'}
+OUTPUTS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+
+def read_lines(request):
+    """Строки тела запроса по мере чтения, без загрузки тела в память"""
+    lines = iter(request._request)
+    first = next(lines, b'')
+    # BOM, который добавляет Excel при сохранении в CSV UTF-8
+    yield first.decode('utf-8-sig')
+    for line in lines:
+        yield line.decode('utf-8')
+
+
+def read_rows(request):
+    """Строки CSV (первая строка - заголовок) или NDJSON из тела запроса как пары (номер строки, dict)"""
+    content_type = request.content_type.split(';')[0].strip().lower()
+    try:
+        if content_type in CSV_TYPES:
+            reader = csv.DictReader(read_lines(request))
+            for row in reader:
+                yield reader.line_num, row
+        elif content_type in NDJSON_TYPES:
+            for number, line in enumerate(read_lines(request), 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as err:
+                    yield number, ValidationError({'non_field_errors': [f'Invalid JSON: {err}']})
+                    continue
+                yield number, row
+        else:
+            raise UnsupportedMediaType(content_type)
+    except UnicodeDecodeError:
+        raise ValidationError({'non_field_errors': ['Тело запроса должно быть в кодировке UTF-8']})
+
+
+def chunked(iterable, size: int):
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+class ImportReport:
+    """Итог импорта: сколько строк прочитано, сколько записано и первые MAX_IMPORT_ERRORS ошибок"""
+
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.errors = []
+        self.errors_count = 0
+
+    def error(self, line: int, detail) -> None:
+        self.errors_count += 1
+        if len(self.errors) < MAX_IMPORT_ERRORS:
+            self.errors.append({'line': line, 'errors': detail})
+
+    def validate(self, chunk: list, serializer_class) -> list:
+        """Проверяет строки чанка, возвращает [(номер строки, validated_data)] прошедших проверку"""
+        valid = []
+        for line, row in chunk:
+            self.rows += 1
+            if isinstance(row, ValidationError):
+                self.error(line, row.detail)
+                continue
+            serializer = serializer_class(data=row)
+            if serializer.is_valid():
+                valid.append((line, serializer.validated_data))
+            else:
+                self.error(line, serializer.errors)
+        return valid
+
+    def to_dict(self) -> dict:
+        return {
+            'rows': self.rows,
+            'imported': self.imported,
+            'errors_count': self.errors_count,
+            'errors': self.errors,
+        }
+
+
+def import_products(rows) -> dict:
+    """Продукты с полями title, description. Существующий продукт с тем же title обновляется"""
+    report = ImportReport()
+    for chunk in chunked(rows, IMPORT_CHUNK_SIZE):
+        # повтор title в одном чанке - побеждает последняя строка
+        products = {data['title']: Product(**data) for _, data in report.validate(chunk, ProductImportSerializer)}
+        if not products:
+            continue
+        with transaction.atomic():
+            Product.objects.bulk_create(
+                products.values(),
+                update_conflicts=True,
+                unique_fields=['title'],
+                update_fields=['description'],
+            )
+            # bulk_create не отправляет сигналы, кэш сбрасывается явно
+            invalidate_many('product', Product.objects.filter(title__in=products).values_list('id', flat=True))
+        report.imported += len(products)
+    return report.to_dict()
+
+
+def import_positions(rows) -> dict:
+    """Позиции складов с полями address, product (id), quantity, price.
+    Склады создаются по адресу, позиция существующей пары склад-продукт обновляется"""
+    report = ImportReport()
+    for chunk in chunked(rows, IMPORT_CHUNK_SIZE):
+        valid = report.validate(chunk, PositionImportSerializer)
+        products = set(
+            Product.objects.filter(pk__in={data['product'] for _, data in valid}).values_list('id', flat=True)
+        )
+        for line, data in valid:
+            if data['product'] not in products:
+                report.error(line, {'product': [f'Invalid pk "{data["product"]}" - object does not exist.']})
+        valid = [data for _, data in valid if data['product'] in products]
+        if not valid:
+            continue
+        with transaction.atomic():
+            addresses = {data['address'] for data in valid}
+            Stock.objects.bulk_create([Stock(address=address) for address in addresses], ignore_conflicts=True)
+            stocks = dict(Stock.objects.filter(address__in=addresses).values_list('address', 'id'))
+            # повтор пары склад-продукт в одном чанке - побеждает последняя строка
+            positions = {
+                (stocks[data['address']], data['product']): StockProduct(
+                    stock_id=stocks[data['address']], product_id=data['product'],
+                    quantity=data['quantity'], price=data['price'],
+                )
+                for data in valid
+            }
+            StockProduct.objects.bulk_create(
+                positions.values(),
+                update_conflicts=True,
+                unique_fields=['stock', 'product'],
+                update_fields=['quantity', 'price'],
+            )
+            changed = {stock_id for stock_id, _ in positions}
+            for stock_id in changed:
+                stock_positions_changed(stock_id)
+            invalidate_many('stock', changed)
+        report.imported += len(positions)
+    return report.to_dict()
+
+
+class Echo:
+    """Файл для csv.writer, который возвращает записанную строку вместо записи"""
+
+    def write(self, value):
+        return value
+
+
+def stream_rows(header: list[str], rows, output: str):
+    if output == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(header)
+        for row in rows:
+            yield writer.writerow(row)
+    else:
+        for row in rows:
+            yield json.dumps(dict(zip(header, row)), ensure_ascii=False, default=str) + '\n'
+
+
+def export_response(queryset, columns: dict[str, str], output: str, filename: str) -> StreamingHttpResponse:
+    """Потоковый ответ со строками queryset, которые читаются из базы по EXPORT_CHUNK_SIZE.
+    columns - колонка файла -> поле queryset, колонки совпадают с колонками импорта"""
+    if output not in OUTPUTS:
+        raise ValidationError({'output': f'Допустимые значения: {", ".join(OUTPUTS)}'})
+    rows = queryset.values_list(*columns.values()).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    response = StreamingHttpResponse(stream_rows(list(columns), rows, output), content_type=OUTPUTS[output])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{output}"'
+    return response
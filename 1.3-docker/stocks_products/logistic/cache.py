@@ -0,0 +1,88 @@
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+CACHE_TIMEOUT = getattr(settings, 'LOGISTIC_CACHE_TIMEOUT', 300)
+
+
+def version_key(scope: str, pk=None) -> str:
+    return f'logistic:version:{scope}' if pk is None else f'logistic:version:{scope}:{pk}'
+
+
+def get_version(scope: str, pk=None) -> int:
+    """Текущая версия списка (pk=None) или объекта. Если ключа версии нет (еще не было или вытеснен),
+    начальная версия - текущее время, чтобы не совпасть ни с одной из прежних"""
+    key = version_key(scope, pk)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(key: str) -> None:
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), None)
+
+
+def invalidate(scope: str, pk=None) -> None:
+    """Сбрасывает закэшированные списки scope и, если задан pk, ответы по этому объекту.
+    Внутри транзакции - после коммита, иначе параллельный запрос успеет закэшировать старые данные"""
+    invalidate_many(scope, [] if pk is None else [pk])
+
+
+def invalidate_many(scope: str, pks) -> None:
+    """То же, что invalidate, для нескольких объектов сразу (массовые операции без сигналов)"""
+    pks = list(pks)
+
+    def bump():
+        bump_version(version_key(scope))
+        for pk in pks:
+            bump_version(version_key(scope, pk))
+
+    transaction.on_commit(bump)
+
+
+class CachedViewSetMixin:
+    """
+    Кэш ответов list и retrieve для ModelViewSet.
+    Ключ содержит версию (списков cache_scope или конкретного объекта), путь и все параметры запроса,
+    поэтому фильтры, поиск и курсоры кэшируются отдельно. Сброс - увеличением версии через invalidate,
+    старые записи просто истекают по таймауту.
+    """
+
+    cache_scope = None
+    cache_timeout = CACHE_TIMEOUT
+
+    def get_cache_key(self, request, version) -> str:
+        params = urlencode(sorted(request.query_params.lists()), doseq=True)
+        digest = hashlib.sha1(f'{request.get_host()}{request.path}?{params}'.encode()).hexdigest()
+        return f'logistic:{self.cache_scope}:{version}:{digest}'
+
+    def cached_response(self, request, version, view, *args, **kwargs):
+        key = self.get_cache_key(request, version)
+        data = cache.get(key)
+        if data is not None:
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+        response = view(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, self.cache_timeout)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        version = get_version(self.cache_scope)
+        return self.cached_response(request, version, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        version = get_version(self.cache_scope, kwargs[self.lookup_url_kwarg or self.lookup_field])
+        return self.cached_response(request, version, super().retrieve, *args, **kwargs)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from logistic.totals import rebuild_stock_summary
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает таблицу итогов складов StockSummary по всем позициям'
+
+    def handle(self, *args, **options):
+        count = rebuild_stock_summary()
+        self.stdout.write(f'stock summaries rebuilt: {count}')
@@ -33,3 +33,26 @@ class StockProduct(models.Model):
         decimal_places=2,
         validators=[MinValueValidator(0)],
     )
+
+    class Meta:
+        constraints = [
+            # по ней bulk_create обновляет существующие позиции (ON CONFLICT)
+            models.UniqueConstraint(fields=['stock', 'product'], name='unique_stock_product'),
+        ]
+        indexes = [
+            # фильтр складов по продукту: product -> stock без обращения к таблице
+            models.Index(fields=['product', 'stock'], name='stockproduct_product_stock'),
+        ]
+
+
+class StockSummary(models.Model):
+    """Итоги склада, пересчитываются при изменении его позиций (LOGISTIC_STOCK_SUMMARY, см. logistic.totals)"""
+    stock = models.OneToOneField(
+        Stock,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='summary',
+    )
+    positions_count = models.PositiveIntegerField(default=0)
+    total_quantity = models.PositiveBigIntegerField(default=0)
+    total_value = models.DecimalField(max_digits=24, decimal_places=2, default=0)
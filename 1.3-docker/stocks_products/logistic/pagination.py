@@ -0,0 +1,91 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+# без Postgres оценка - точный COUNT, но не дальше COUNT_LIMIT строк
+COUNT_LIMIT = 10000
+
+
+def estimate_count(queryset) -> int:
+    """Примерное число строк queryset. Postgres - оценка планировщика из EXPLAIN без выполнения запроса,
+    остальные базы - COUNT(*) по подзапросу с LIMIT COUNT_LIMIT"""
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        sql, params = queryset.order_by().query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+    return queryset.order_by()[:COUNT_LIMIT].count()
+
+
+class IdCursorPagination(CursorPagination):
+    """
+    Постраничный вывод по курсору на id: страница - WHERE id > последний id ORDER BY id LIMIT page_size,
+    без COUNT(*) и OFFSET, поэтому глубокие страницы не медленнее первой. Фильтры и поиск применяются
+    до пагинации и работают как прежде.
+    С ?count=estimate в ответ добавляется примерное число записей, см. estimate_count.
+    """
+
+    ordering = 'id'
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = None
+        if request.query_params.get(self.count_query_param) == 'estimate':
+            self.count = estimate_count(queryset)
+        return super().paginate_queryset(queryset, request, view)
+
+    async def apaginate_queryset(self, queryset, request):
+        """paginate_queryset для async-представлений: та же страница и те же курсоры, строки читаются aiterator.
+        Сортировка только по id, поэтому позиция курсора - id записи"""
+        self.count = None
+        if request.query_params.get(self.count_query_param) == 'estimate':
+            self.count = await sync_to_async(estimate_count)(queryset)
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, None)
+        self.cursor = self.decode_cursor(request)
+        offset, reverse, position = self.cursor or (0, False, None)
+
+        queryset = queryset.order_by('-id' if reverse else 'id')
+        if position is not None:
+            queryset = queryset.filter(**{'id__lt' if reverse else 'id__gt': position})
+        # на одну запись больше страницы, чтобы узнать, есть ли следующая; связанные объекты
+        # (prefetch_related) aiterator подгружает на каждый чанк
+        size = self.page_size + 1
+        results = [obj async for obj in queryset[offset:offset + size].aiterator(chunk_size=size)]
+        self.page = results[:self.page_size]
+        following = results[-1].pk if len(results) > self.page_size else None
+
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = position is not None or offset > 0, following is not None
+            self.next_position, self.previous_position = position, following
+        else:
+            self.has_next, self.has_previous = following is not None, position is not None or offset > 0
+            self.next_position, self.previous_position = following, position
+        return self.page
+
+    def get_paginated_data(self, data) -> dict:
+        response = {'next': self.get_next_link(), 'previous': self.get_previous_link(), 'results': data}
+        if self.count is not None:
+            response = {'count': self.count, **response}
+        return response
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_response_schema(self, schema):
+        schema = super().get_paginated_response_schema(schema)
+        schema['properties']['count'] = {'type': 'integer', 'example': 123}
+        return schema
@@ -0,0 +1,62 @@
+from django.db import transaction
+from django.db.models import F
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotFound
+
+from logistic.cache import invalidate_many
+from logistic.models import StockProduct
+from logistic.totals import stock_positions_changed
+
+
+class InsufficientStock(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Недостаточно товара на складе'
+    default_code = 'insufficient_stock'
+
+
+def positions_changed(stock_ids) -> None:
+    # update() не отправляет сигналы
+    stock_ids = set(stock_ids)
+    for stock_id in stock_ids:
+        stock_positions_changed(stock_id)
+    invalidate_many('stock', stock_ids)
+
+
+def change_quantity(stock_id: int, product_id: int, delta: int) -> None:
+    """Одно условное UPDATE: quantity = quantity + delta, при списании только если товара хватает.
+    Проверка и изменение в одном запросе, поэтому параллельные списания не уводят остаток в минус"""
+    positions = StockProduct.objects.filter(stock_id=stock_id, product_id=product_id)
+    if delta < 0:
+        updated = positions.filter(quantity__gte=-delta).update(quantity=F('quantity') + delta)
+    else:
+        updated = positions.update(quantity=F('quantity') + delta)
+    if not updated:
+        # причину выясняем только при неудаче, успешный путь - один запрос
+        if not positions.exists():
+            raise NotFound(f'Нет позиции продукта {product_id} на складе {stock_id}')
+        raise InsufficientStock(f'Недостаточно продукта {product_id} на складе {stock_id}')
+
+
+def reserve(stock_id: int, product_id: int, quantity: int) -> None:
+    with transaction.atomic():
+        change_quantity(stock_id, product_id, -quantity)
+        positions_changed([stock_id])
+
+
+def release(stock_id: int, product_id: int, quantity: int) -> None:
+    with transaction.atomic():
+        change_quantity(stock_id, product_id, quantity)
+        positions_changed([stock_id])
+
+
+def reserve_batch(items: list[dict]) -> None:
+    """Резерв всех строк заказа или ни одной. Строки с одной позицией суммируются,
+    позиции блокируются в порядке (stock, product), чтобы встречные заказы не взаимоблокировались"""
+    totals = {}
+    for item in items:
+        key = (item['stock'], item['product'])
+        totals[key] = totals.get(key, 0) + item['quantity']
+    with transaction.atomic():
+        for (stock_id, product_id), quantity in sorted(totals.items()):
+            change_quantity(stock_id, product_id, -quantity)
+        positions_changed(stock_id for stock_id, _ in totals)
@@ -0,0 +1,96 @@
+import logging
+import operator
+from functools import reduce
+
+from django.db import DatabaseError, connections
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import SearchFilter
+
+logger = logging.getLogger(__name__)
+
+PRODUCT_FTS_TABLE = 'logistic_product_fts'
+# trigram-индексы (Postgres и FTS5) ищут подстроки от трех символов, более короткие термы ищутся перебором
+MIN_INDEXED_TERM = 3
+
+POSTGRES_INDEXES = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    # icontains в Postgres - UPPER("поле"::text) LIKE UPPER(%s), индекс строится по тому же выражению
+    'CREATE INDEX IF NOT EXISTS logistic_product_title_trgm '
+    'ON logistic_product USING gin (UPPER(title::text) gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS logistic_product_description_trgm '
+    'ON logistic_product USING gin (UPPER(description::text) gin_trgm_ops)',
+]
+
+SQLITE_INDEXES = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {PRODUCT_FTS_TABLE} USING fts5("
+    f"title, description, content='logistic_product', content_rowid='id', tokenize='trigram')",
+    f"CREATE TRIGGER IF NOT EXISTS {PRODUCT_FTS_TABLE}_ai AFTER INSERT ON logistic_product BEGIN "
+    f"INSERT INTO {PRODUCT_FTS_TABLE}(rowid, title, description) VALUES (new.id, new.title, new.description); END",
+    f"CREATE TRIGGER IF NOT EXISTS {PRODUCT_FTS_TABLE}_ad AFTER DELETE ON logistic_product BEGIN "
+    f"INSERT INTO {PRODUCT_FTS_TABLE}({PRODUCT_FTS_TABLE}, rowid, title, description) "
+    f"VALUES ('delete', old.id, old.title, old.description); END",
+    f"CREATE TRIGGER IF NOT EXISTS {PRODUCT_FTS_TABLE}_au AFTER UPDATE ON logistic_product BEGIN "
+    f"INSERT INTO {PRODUCT_FTS_TABLE}({PRODUCT_FTS_TABLE}, rowid, title, description) "
+    f"VALUES ('delete', old.id, old.title, old.description); "
+    f"INSERT INTO {PRODUCT_FTS_TABLE}(rowid, title, description) VALUES (new.id, new.title, new.description); END",
+    f"INSERT INTO {PRODUCT_FTS_TABLE}({PRODUCT_FTS_TABLE}) VALUES ('rebuild')",
+]
+
+
+def create_search_indexes(sender, using='default', **kwargs):
+    """Обработчик post_migrate: индексы поиска по продуктам, которые не описать в Meta.indexes.
+    Postgres - trigram GIN, SQLite - внешняя таблица FTS5 с триггерами. Повторный запуск безопасен"""
+    connection = connections[using]
+    statements = {'postgresql': POSTGRES_INDEXES, 'sqlite': SQLITE_INDEXES}.get(connection.vendor, [])
+    try:
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+    except DatabaseError as err:
+        # например, нет прав на CREATE EXTENSION или SQLite собран без FTS5: поиск работает без индекса
+        logger.warning('search indexes are not created: %s', err)
+
+
+def has_fts_table(connection) -> bool:
+    if not hasattr(connection, '_product_fts'):
+        connection._product_fts = PRODUCT_FTS_TABLE in connection.introspection.table_names()
+    return connection._product_fts
+
+
+class ProductSearchFilter(SearchFilter):
+    """SearchFilter, который на SQLite ищет по индексу FTS5 вместо LIKE '%...%' по всей таблице.
+    Поля поиска - колонки продукта, у других моделей с путем до продукта (products__title у складов).
+    На Postgres работает как обычный SearchFilter: icontains использует trigram-индексы"""
+
+    def filter_queryset(self, request, queryset, view):
+        connection = connections[queryset.db]
+        search_fields = self.get_search_fields(view, request)
+        search_terms = self.get_search_terms(request)
+        if connection.vendor != 'sqlite' or not search_fields or not search_terms or not has_fts_table(connection):
+            return super().filter_queryset(request, queryset, view)
+
+        paths = {field.rpartition('__')[0] for field in search_fields}
+        if len(paths) != 1:
+            return super().filter_queryset(request, queryset, view)
+        path = paths.pop()
+        lookup = f'{path}__in' if path else 'pk__in'
+        columns = ' '.join(field.rpartition('__')[2] for field in search_fields)
+
+        conditions = []
+        for term in search_terms:
+            if len(term) >= MIN_INDEXED_TERM:
+                query = '{%s} : "%s"' % (columns, term.replace('"', '""'))
+                conditions.append(Q(**{lookup: RawSQL(
+                    f'SELECT rowid FROM {PRODUCT_FTS_TABLE} WHERE {PRODUCT_FTS_TABLE} MATCH %s', [query]
+                )}))
+            else:
+                conditions.append(reduce(operator.or_, (Q(**{f'{field}__icontains': term}) for field in search_fields)))
+        base = queryset
+        # одним filter, как SearchFilter: все термы должны найтись в одном продукте
+        queryset = queryset.filter(reduce(operator.and_, conditions))
+        if path:
+            # как SearchFilter для связей многие-ко-многим: без дублей и без лишнего JOIN во внешнем запросе,
+            # который умножил бы агрегаты итогов
+            queryset = base.filter(Exists(queryset.filter(pk=OuterRef('pk'))))
+        return queryset
@@ -1,6 +1,11 @@
+from decimal import Decimal
+
+from django.db import transaction
 from rest_framework import serializers
 
+from logistic.cache import invalidate
 from logistic.models import Product, StockProduct, Stock
+from logistic.totals import VALUE_FIELD, stock_positions_changed
 
 
 class ProductSerializer(serializers.ModelSerializer):
@@ -10,11 +15,52 @@ class ProductSerializer(serializers.ModelSerializer):
         fields = ['id', 'title', 'description']
 
 
+def product_id(data):
+    """id продукта из запроса: целое число (не bool) или строка из цифр, иначе None"""
+    if isinstance(data, int) and not isinstance(data, bool):
+        return data
+    if isinstance(data, str) and data.isascii() and data.isdigit():
+        return int(data)
+    return None
+
+
+class PositionProductField(serializers.PrimaryKeyRelatedField):
+    """Продукт позиции по id. Продукты из products, заранее загруженные списком позиций, берутся без запроса.
+    Прочие значения (True, 1.9 и т.п.) проверяются штатно, как без предзагрузки"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.products = {}
+
+    def to_internal_value(self, data):
+        product = self.products.get(product_id(data))
+        if product is None:
+            return super().to_internal_value(data)
+        return product
+
+
+class PositionListSerializer(serializers.ListSerializer):
+    """Загружает продукты всех позиций одним запросом, а не запросом на каждую позицию"""
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            ids = set()
+            for item in data:
+                pk = product_id(item.get('product')) if isinstance(item, dict) else None
+                if pk is not None:
+                    ids.add(pk)
+            self.child.fields['product'].products = Product.objects.in_bulk(ids)
+        return super().to_internal_value(data)
+
+
 class ProductPositionSerializer(serializers.ModelSerializer):
     # настройте сериализатор для позиции продукта на складе
+    product = PositionProductField(queryset=Product.objects.all())
+
     class Meta:
         model = StockProduct
         fields = ['product', 'quantity', 'price']
+        list_serializer_class = PositionListSerializer
 
     def create(self, validated_data):
         return StockProduct.objects.create(**validated_data)
@@ -35,36 +81,101 @@ class StockSerializer(serializers.ModelSerializer):
         model = Stock
         fields = ['address', 'positions']
 
+    def validate_positions(self, positions):
+        products = [position['product'].pk for position in positions]
+        if len(products) != len(set(products)):
+            raise serializers.ValidationError('Продукт указан в позициях склада несколько раз')
+        return positions
+
+    @transaction.atomic
     def create(self, validated_data):
 
         # достаем связанные данные для других таблиц
-        positions = validated_data.pop('positions')
+        positions = validated_data.pop('positions', [])
 
         # создаем склад по его параметрам
         stock = super().create(validated_data)
 
-        # здесь вам надо заполнить связанные таблицы
-        # в нашем случае: таблицу StockProduct
-        # с помощью списка positions
-        for position in positions:
-            StockProduct.objects.create(stock=stock, **position)
+        # все позиции склада одним запросом
+        StockProduct.objects.bulk_create([StockProduct(stock=stock, **position) for position in positions])
+        # bulk_create не отправляет post_save
+        stock_positions_changed(stock.pk)
+        invalidate('stock', stock.pk)
         return stock
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        # достаем связанные данные для других таблиц
-        positions = validated_data.pop('positions')
+        # достаем связанные данные для других таблиц; при частичном обновлении позиций может не быть
+        positions = validated_data.pop('positions', None)
 
         # обновляем склад по его параметрам
         stock = super().update(instance, validated_data)
 
-        # здесь вам надо обновить связанные таблицы
-        # в нашем случае: таблицу StockProduct
-        # с помощью списка positions
-        for position in positions:
-            object, created = StockProduct.objects.update_or_create(
-                stock=stock,
-                product=position['product'],
-                defaults={'stock': stock, 'product': position['product'], 'quantity': position['quantity'],
-                          'price': position['price']}
+        if positions is not None:
+            # новые позиции вставляются, существующие обновляются по (stock, product) тем же запросом
+            StockProduct.objects.bulk_create(
+                [StockProduct(stock=stock, **position) for position in positions],
+                update_conflicts=True,
+                unique_fields=['stock', 'product'],
+                update_fields=['quantity', 'price'],
             )
+            # позиции, которых нет в запросе, удаляются одним DELETE: delete() из-за подключенного post_delete
+            # выбрал бы их и отправил сигнал на каждую, пересчитывая итоги склада по разу на позицию.
+            # На StockProduct никто не ссылается, поэтому каскад не нужен
+            stale = stock.positions.exclude(product__in=[position['product'] for position in positions])
+            stale._raw_delete(stale.db)
+            # bulk_create и _raw_delete не отправляют сигналы, итоги и кэш склада сбрасываются один раз
+            stock_positions_changed(stock.pk)
+            invalidate('stock', stock.pk)
         return stock
+
+
+class StockTotalsSerializer(serializers.ModelSerializer):
+    # поля из annotate_stock_totals
+    positions_count = serializers.IntegerField(read_only=True)
+    total_quantity = serializers.IntegerField(read_only=True)
+    total_value = serializers.DecimalField(VALUE_FIELD.max_digits, VALUE_FIELD.decimal_places, read_only=True)
+
+    class Meta:
+        model = Stock
+        fields = ['id', 'address', 'positions_count', 'total_quantity', 'total_value']
+
+
+class ProductTotalsSerializer(serializers.ModelSerializer):
+    # поля из annotate_product_totals; позиция продукта на складе одна, поэтому позиций столько же, сколько складов
+    stocks_count = serializers.IntegerField(source='positions_count', read_only=True)
+    total_quantity = serializers.IntegerField(read_only=True)
+    total_value = serializers.DecimalField(VALUE_FIELD.max_digits, VALUE_FIELD.decimal_places, read_only=True)
+
+    class Meta:
+        model = Product
+        fields = ['id', 'title', 'stocks_count', 'total_quantity', 'total_value']
+
+
+class ProductImportSerializer(serializers.ModelSerializer):
+    # уникальность title не проверяется запросом на каждую строку: импорт обновляет продукт с тем же title
+    class Meta:
+        model = Product
+        fields = ['title', 'description']
+        extra_kwargs = {'title': {'validators': []}}
+
+
+class PositionImportSerializer(serializers.Serializer):
+    # существование продуктов импорт проверяет одним запросом на чанк
+    address = serializers.CharField(max_length=200)
+    product = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0)
+    price = serializers.DecimalField(max_digits=18, decimal_places=2, min_value=Decimal('0'))
+
+
+class ReservationSerializer(serializers.Serializer):
+    product = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class ReservationItemSerializer(ReservationSerializer):
+    stock = serializers.IntegerField()
+
+
+class BatchReservationSerializer(serializers.Serializer):
+    items = ReservationItemSerializer(many=True, allow_empty=False)
@@ -0,0 +1,23 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from logistic.cache import invalidate
+from logistic.models import Product, Stock, StockProduct
+from logistic.totals import stock_positions_changed
+
+
+@receiver([post_save, post_delete], sender=Product)
+def product_changed(sender, instance, **kwargs):
+    invalidate('product', instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Stock)
+def stock_changed(sender, instance, **kwargs):
+    invalidate('stock', instance.pk)
+
+
+@receiver([post_save, post_delete], sender=StockProduct)
+def position_changed(sender, instance, **kwargs):
+    # позиции выводятся только внутри склада, поэтому сбрасывается склад
+    stock_positions_changed(instance.stock_id)
+    invalidate('stock', instance.stock_id)
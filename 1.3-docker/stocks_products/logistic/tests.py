@@ -0,0 +1,245 @@
+import threading
+from urllib.parse import parse_qs, urlparse
+from unittest import mock, skipUnless
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from logistic import totals
+from logistic.models import Product, Stock, StockProduct
+from logistic.reservations import InsufficientStock, reserve
+from logistic.search import has_fts_table
+from logistic.serializers import StockSerializer
+from logistic.views import ProductViewSet, StockViewSet
+
+
+def filtered_queryset(viewset_class, params):
+    """queryset списка после фильтров и поиска, как его строит list"""
+    view = viewset_class(request=Request(APIRequestFactory().get('/', params)), format_kwarg=None, action='list')
+    return view.filter_queryset(view.get_queryset())
+
+
+def cursor_param(link: str) -> str:
+    return parse_qs(urlparse(link).query)['cursor'][0]
+
+
+def explain(queryset) -> str:
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return '\n'.join(row[-1] for row in cursor.fetchall())
+        # на нескольких строках планировщик и так выберет перебор, проверяется, что индекс применим
+        cursor.execute('SET LOCAL enable_seqscan = off')
+        cursor.execute('EXPLAIN ' + sql, params)
+        return '\n'.join(row[0] for row in cursor.fetchall())
+
+
+@skipUnless(connection.vendor in ('sqlite', 'postgresql'), 'индексы поиска есть только для SQLite и Postgres')
+class SearchIndexTest(TestCase):
+    """Поиск и фильтр складов по продукту идут по индексам из logistic.search и StockProduct.Meta"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tomato = Product.objects.create(title='Помидор', description='Красный, мясистый')
+        cls.cucumber = Product.objects.create(title='Огурец', description='Зеленый, хрустящий')
+        cls.stock = Stock.objects.create(address='Склад 1')
+        cls.other = Stock.objects.create(address='Склад 2')
+        StockProduct.objects.create(stock=cls.stock, product=cls.tomato, quantity=5, price=10)
+        StockProduct.objects.create(stock=cls.stock, product=cls.cucumber, quantity=5, price=10)
+        StockProduct.objects.create(stock=cls.other, product=cls.cucumber, quantity=5, price=10)
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and not has_fts_table(connection):
+            self.skipTest('SQLite собран без FTS5')
+
+    def assert_uses_search_index(self, plan: str):
+        if connection.vendor == 'sqlite':
+            self.assertIn('logistic_product_fts VIRTUAL TABLE INDEX', plan)
+        else:
+            self.assertRegex(plan, r'logistic_product_(title|description)_trgm')
+
+    def test_product_search_uses_index(self):
+        queryset = filtered_queryset(ProductViewSet, {'search': 'мясист'})
+        self.assertEqual(list(queryset), [self.tomato])
+        self.assert_uses_search_index(explain(queryset))
+
+    def test_stock_search_uses_index(self):
+        queryset = filtered_queryset(StockViewSet, {'search': 'помид'})
+        self.assertEqual(list(queryset), [self.stock])
+        self.assert_uses_search_index(explain(queryset))
+
+    def test_stock_search_has_no_duplicates(self):
+        # оба продукта первого склада подходят под "ый,"
+        queryset = filtered_queryset(StockViewSet, {'search': 'ый,'})
+        self.assertEqual(sorted(stock.pk for stock in queryset), [self.stock.pk, self.other.pk])
+
+    def test_stock_filter_by_product_uses_index(self):
+        queryset = filtered_queryset(StockViewSet, {'products': self.tomato.pk})
+        self.assertEqual(list(queryset), [self.stock])
+        self.assertIn('stockproduct_product_stock', explain(queryset))
+
+
+class StockListQueriesTest(TestCase):
+    """Список складов с позициями - постоянное число запросов, не зависящее от размера страницы"""
+
+    @classmethod
+    def setUpTestData(cls):
+        products = Product.objects.bulk_create([Product(title=f'Продукт {i}') for i in range(3)])
+        stocks = Stock.objects.bulk_create([Stock(address=f'Склад {i}') for i in range(30)])
+        StockProduct.objects.bulk_create([
+            StockProduct(stock=stock, product=product, quantity=1, price=1)
+            for stock in stocks for product in products
+        ])
+
+    def setUp(self):
+        # ответ из кэша не делает запросов вообще
+        cache.clear()
+
+    def test_list_queries_do_not_grow_with_page_size(self):
+        for page_size in (5, 25):
+            with self.subTest(page_size=page_size):
+                # склады страницы и позиции всех этих складов
+                with self.assertNumQueries(2):
+                    response = self.client.get(reverse('stock-list'), {'page_size': page_size})
+                self.assertEqual(response.status_code, 200)
+                results = response.json()['results']
+                self.assertEqual(len(results), page_size)
+                self.assertTrue(all(len(stock['positions']) == 3 for stock in results))
+
+
+class StockUpdateTest(TestCase):
+    """Обновление позиций склада: лишние позиции удаляются одним запросом, итоги пересчитываются один раз"""
+
+    def test_removed_positions_are_deleted_at_once(self):
+        products = Product.objects.bulk_create([Product(title=f'Продукт {i}') for i in range(4)])
+        stock = Stock.objects.create(address='Склад 1')
+        StockProduct.objects.bulk_create([
+            StockProduct(stock=stock, product=product, quantity=1, price=1) for product in products
+        ])
+        serializer = StockSerializer(stock, data={
+            'address': stock.address, 'positions': [{'product': products[0].pk, 'quantity': 2, 'price': 1}],
+        })
+        serializer.is_valid(raise_exception=True)
+
+        with mock.patch.object(totals, 'STOCK_SUMMARY', True), \
+                mock.patch.object(totals, 'refresh_stock_summary') as refresh, \
+                self.captureOnCommitCallbacks(execute=True), \
+                CaptureQueriesContext(connection) as queries:
+            serializer.save()
+
+        deletes = [query['sql'] for query in queries if query['sql'].startswith('DELETE')]
+        self.assertEqual(len(deletes), 1)
+        refresh.assert_called_once_with(stock.pk)
+        self.assertEqual(list(stock.positions.values_list('product', 'quantity')), [(products[0].pk, 2)])
+
+
+class AsyncViewsTest(TestCase):
+    """async_views отдают то же, что синхронные ModelViewSet: поля, фильтры, поиск и курсоры"""
+
+    @classmethod
+    def setUpTestData(cls):
+        products = Product.objects.bulk_create([
+            Product(title=f'Продукт {i}', description='свежий' if i % 2 else 'сушеный') for i in range(5)
+        ])
+        stocks = Stock.objects.bulk_create([Stock(address=f'Склад {i}') for i in range(5)])
+        StockProduct.objects.bulk_create([
+            StockProduct(stock=stock, product=product, quantity=1, price=1)
+            for stock in stocks for product in products[:stock.pk % 3 + 1]
+        ])
+        cls.product = products[0]
+
+    def setUp(self):
+        cache.clear()
+
+    async def assert_same(self, path: str, params: dict | None = None):
+        sync = (await sync_to_async(self.client.get)(f'/api/v1/{path}', params)).json()
+        response = await self.async_client.get(f'/api/v1/async/{path}', params)
+        self.assertEqual(response.json(), self.normalized(sync))
+        return sync
+
+    @staticmethod
+    def normalized(data: dict) -> dict:
+        # ссылки на страницы отличаются только путем
+        for link in ('next', 'previous'):
+            if isinstance(data, dict) and data.get(link):
+                data = {**data, link: data[link].replace('/api/v1/', '/api/v1/async/')}
+        return data
+
+    async def test_lists_match(self):
+        for path, params in [
+            ('products/', {}),
+            ('products/', {'search': 'свеж'}),
+            ('products/', {'title': 'Продукт 1'}),
+            ('stocks/', {'products': self.product.pk}),
+            ('stocks/', {'search': 'Продукт 2'}),
+            ('stocks/', {'products': 'x'}),
+            ('stocks/', {'cursor': 'x'}),
+        ]:
+            with self.subTest(path=path, params=params):
+                await self.assert_same(path, params)
+
+    async def test_cursors_match(self):
+        # вперед по next и обратно по previous
+        page = await self.assert_same('stocks/', {'page_size': 2})
+        pages = 1
+        while page['next']:
+            page = await self.assert_same('stocks/', {'page_size': 2, 'cursor': cursor_param(page['next'])})
+            pages += 1
+        self.assertEqual(pages, 3)
+        page = await self.assert_same('stocks/', {'page_size': 2, 'cursor': cursor_param(page['previous'])})
+        self.assertIsNotNone(page['previous'])
+
+    async def test_details_match(self):
+        stock = await Stock.objects.afirst()
+        await self.assert_same(f'stocks/{stock.pk}/')
+        await self.assert_same(f'products/{self.product.pk}/')
+        await self.assert_same('stocks/0/')
+
+
+class ConcurrentReserveTest(TransactionTestCase):
+    """Параллельные резервы одной позиции: остаток не уходит в минус и не теряет списаний"""
+
+    STOCK = 10
+    THREADS = 20
+
+    def test_concurrent_reserves_never_oversell(self):
+        product = Product.objects.create(title='Помидор')
+        stock = Stock.objects.create(address='Склад 1')
+        position = StockProduct.objects.create(stock=stock, product=product, quantity=self.STOCK, price=1)
+        barrier = threading.Barrier(self.THREADS)
+        reserved, refused, errors = [], [], []
+
+        def worker():
+            try:
+                barrier.wait()
+                try:
+                    reserve(stock.pk, product.pk, 1)
+                except InsufficientStock:
+                    refused.append(1)
+                else:
+                    reserved.append(1)
+            except Exception as err:
+                errors.append(err)
+            finally:
+                # у каждого потока свое соединение
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        position.refresh_from_db()
+        self.assertEqual(errors, [])
+        self.assertGreaterEqual(position.quantity, 0)
+        self.assertEqual(sum(reserved), self.STOCK)
+        self.assertEqual(len(refused), self.THREADS - self.STOCK)
+        self.assertEqual(position.quantity, 0)
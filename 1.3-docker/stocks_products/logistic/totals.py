@@ -0,0 +1,83 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Sum, Value
+from django.db.models.functions import Coalesce
+
+from logistic.models import Stock, StockSummary
+
+# читать итоги складов из таблицы StockSummary, а не считать по позициям при каждом запросе
+STOCK_SUMMARY = getattr(settings, 'LOGISTIC_STOCK_SUMMARY', False)
+LOW_STOCK_THRESHOLD = getattr(settings, 'LOGISTIC_LOW_STOCK_THRESHOLD', 10)
+
+VALUE_FIELD = DecimalField(max_digits=24, decimal_places=2)
+
+
+def position_totals(prefix: str = '') -> dict:
+    """Агрегаты по позициям для annotate/aggregate; prefix - путь до StockProduct, например 'positions__'"""
+    return {
+        'positions_count': Count(f'{prefix}id'),
+        'total_quantity': Coalesce(Sum(f'{prefix}quantity'), 0),
+        'total_value': Coalesce(
+            Sum(F(f'{prefix}quantity') * F(f'{prefix}price'), output_field=VALUE_FIELD),
+            Value(0),
+            output_field=VALUE_FIELD,
+        ),
+    }
+
+
+def annotate_stock_totals(queryset):
+    """Итоги складов одним запросом: GROUP BY по складам или чтение из StockSummary"""
+    if STOCK_SUMMARY:
+        return queryset.annotate(
+            positions_count=Coalesce(F('summary__positions_count'), 0),
+            total_quantity=Coalesce(F('summary__total_quantity'), 0),
+            total_value=Coalesce(F('summary__total_value'), Value(0), output_field=VALUE_FIELD),
+        )
+    return queryset.annotate(**position_totals('positions__'))
+
+
+def annotate_product_totals(queryset):
+    """Остатки продуктов по всем складам одним запросом"""
+    return queryset.annotate(**position_totals('positions__'))
+
+
+def low_stock(queryset, threshold: int = LOW_STOCK_THRESHOLD):
+    """Продукты, которых на всех складах вместе меньше threshold, включая отсутствующие совсем"""
+    return annotate_product_totals(queryset).filter(total_quantity__lt=threshold)
+
+
+def refresh_stock_summary(stock_id: int) -> None:
+    """Пересчитывает итоги одного склада: агрегат по его позициям и upsert в StockSummary"""
+    totals = Stock.objects.filter(pk=stock_id).annotate(**position_totals('positions__')).values(
+        'positions_count', 'total_quantity', 'total_value'
+    ).first()
+    if totals is None:
+        # склад удален, его итоги удалены каскадом
+        return
+    StockSummary.objects.bulk_create(
+        [StockSummary(stock_id=stock_id, **totals)],
+        update_conflicts=True,
+        unique_fields=['stock'],
+        update_fields=['positions_count', 'total_quantity', 'total_value'],
+    )
+
+
+def stock_positions_changed(stock_id: int) -> None:
+    """Вызывается до invalidate: колбэки on_commit выполняются в порядке регистрации, и итоги склада
+    должны быть пересчитаны раньше, чем сброс кэша позволит закэшировать ответ заново"""
+    if STOCK_SUMMARY:
+        transaction.on_commit(lambda: refresh_stock_summary(stock_id))
+
+
+def rebuild_stock_summary() -> int:
+    """Полный пересчет StockSummary, например после включения LOGISTIC_STOCK_SUMMARY"""
+    with transaction.atomic():
+        StockSummary.objects.all().delete()
+        summaries = [
+            StockSummary(stock_id=row['id'], positions_count=row['positions_count'],
+                         total_quantity=row['total_quantity'], total_value=row['total_value'])
+            for row in Stock.objects.annotate(**position_totals('positions__')).values(
+                'id', 'positions_count', 'total_quantity', 'total_value')
+        ]
+        StockSummary.objects.bulk_create(summaries, batch_size=1000)
+    return len(summaries)
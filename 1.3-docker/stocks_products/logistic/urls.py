@@ -1,9 +1,17 @@
+from django.urls import path
 from rest_framework.routers import DefaultRouter
 
+from logistic import async_views
 from logistic.views import ProductViewSet, StockViewSet
 
 router = DefaultRouter()
 router.register('products', ProductViewSet)
 router.register('stocks', StockViewSet)
 
-urlpatterns = router.urls
+urlpatterns = router.urls + [
+    # только чтение через async ORM, для запуска под ASGI (stocks_products.asgi)
+    path('async/products/', async_views.product_list, name='async-product-list'),
+    path('async/products/<int:pk>/', async_views.product_detail, name='async-product-detail'),
+    path('async/stocks/', async_views.stock_list, name='async-stock-list'),
+    path('async/stocks/<int:pk>/', async_views.stock_detail, name='async-stock-detail'),
+]
@@ -1,26 +1,142 @@
-from rest_framework.filters import SearchFilter
-from rest_framework.pagination import PageNumberPagination
+from django.shortcuts import get_object_or_404
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
 from django_filters.rest_framework import DjangoFilterBackend
 
-from logistic.models import Product, Stock
-from logistic.serializers import ProductSerializer, StockSerializer
+from logistic import reservations
+from logistic.bulk import export_response, import_positions, import_products, read_rows
+from logistic.cache import CachedViewSetMixin, get_version
+from logistic.models import Product, Stock, StockProduct
+from logistic.pagination import IdCursorPagination
+from logistic.search import ProductSearchFilter
+from logistic.serializers import ProductSerializer, StockSerializer, ProductTotalsSerializer, StockTotalsSerializer, \
+    ReservationSerializer, BatchReservationSerializer
+from logistic.totals import LOW_STOCK_THRESHOLD, annotate_product_totals, annotate_stock_totals, low_stock
 
 
-class ProductViewSet(ModelViewSet):
+def paginated_response(view, queryset, serializer_class):
+    page = view.paginate_queryset(queryset)
+    return view.get_paginated_response(serializer_class(page, many=True).data)
+
+
+class ProductViewSet(CachedViewSetMixin, ModelViewSet):
+    cache_scope = 'product'
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     # при необходимости добавьте параметры фильтрации
-    filter_backends = [DjangoFilterBackend, SearchFilter]
-    search_fields = ['description']
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter]
+    # поля поиска должны совпадать с колонками индекса в logistic.search
+    search_fields = ['title', 'description']
     filterset_fields = ['title']
-    pagination_class = PageNumberPagination
+    pagination_class = IdCursorPagination
+
+    def totals_version(self) -> str:
+        # остатки зависят и от продуктов, и от позиций складов
+        return f"{get_version('product')}.{get_version('stock')}"
+
+    @action(detail=False)
+    def totals(self, request):
+        """Количество и стоимость каждого продукта на всех складах, с фильтрами и поиском списка"""
+        def view(request):
+            queryset = annotate_product_totals(self.filter_queryset(self.get_queryset()))
+            return paginated_response(self, queryset, ProductTotalsSerializer)
+        return self.cached_response(request, self.totals_version(), view)
+
+    @action(detail=False, url_path='low-stock')
+    def low_stock(self, request):
+        """Продукты, которых на всех складах вместе меньше ?threshold= (по умолчанию LOW_STOCK_THRESHOLD)"""
+        try:
+            threshold = int(request.query_params.get('threshold', LOW_STOCK_THRESHOLD))
+        except ValueError:
+            raise ValidationError({'threshold': 'Должно быть целым числом'})
+
+        def view(request):
+            queryset = low_stock(self.filter_queryset(self.get_queryset()), threshold)
+            return paginated_response(self, queryset, ProductTotalsSerializer)
+        return self.cached_response(request, self.totals_version(), view)
+
+    @action(detail=False, methods=['post'], url_path='import')
+    def import_rows(self, request):
+        """Массовая загрузка продуктов: тело CSV (text/csv) или NDJSON (application/x-ndjson)
+        с полями title, description, читается и пишется в базу частями"""
+        return Response(import_products(read_rows(request)))
+
+    @action(detail=False)
+    def export(self, request):
+        """Потоковая выгрузка продуктов с фильтрами списка, ?output=csv|ndjson"""
+        queryset = self.filter_queryset(self.get_queryset()).order_by('id')
+        columns = {'id': 'id', 'title': 'title', 'description': 'description'}
+        return export_response(queryset, columns, request.query_params.get('output', 'csv'), 'products')
 
 
-class StockViewSet(ModelViewSet):
-    queryset = Stock.objects.all()
+class StockViewSet(CachedViewSetMixin, ModelViewSet):
+    cache_scope = 'stock'
+    # позиции складов страницы загружаются одним запросом, а не запросом на каждый склад;
+    # ProductPositionSerializer отдает product как id, поэтому сами продукты не подгружаются
+    queryset = Stock.objects.prefetch_related('positions')
     serializer_class = StockSerializer
     # при необходимости добавьте параметры фильтрации
-    filter_backends = [DjangoFilterBackend, SearchFilter]
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter]
+    # поиск складов по названию и описанию продуктов, по тем же индексам, что и поиск продуктов
+    search_fields = ['products__title', 'products__description']
     filterset_fields = ['products']
-    pagination_class = PageNumberPagination
+    pagination_class = IdCursorPagination
+
+    def get_totals_queryset(self):
+        # позиции для итогов не нужны, агрегаты считает база
+        return annotate_stock_totals(self.get_queryset().prefetch_related(None))
+
+    @action(detail=False)
+    def totals(self, request):
+        """Число позиций, количество и стоимость товара по каждому складу, с фильтрами списка"""
+        def view(request):
+            return paginated_response(self, self.filter_queryset(self.get_totals_queryset()), StockTotalsSerializer)
+        return self.cached_response(request, get_version(self.cache_scope), view)
+
+    @action(detail=True, url_path='totals', url_name='detail-totals')
+    def stock_totals(self, request, pk=None):
+        """Итоги одного склада"""
+        def view(request):
+            stock = get_object_or_404(self.get_totals_queryset(), pk=pk)
+            return Response(StockTotalsSerializer(stock).data)
+        return self.cached_response(request, get_version(self.cache_scope, pk), view)
+
+    @action(detail=False, methods=['post'], url_path='import')
+    def import_rows(self, request):
+        """Массовая загрузка позиций складов: CSV или NDJSON с полями address, product, quantity, price.
+        Склады создаются по адресу, если их еще нет"""
+        return Response(import_positions(read_rows(request)))
+
+    @action(detail=False)
+    def export(self, request):
+        """Потоковая выгрузка позиций складов с фильтрами списка, ?output=csv|ndjson"""
+        stocks = self.filter_queryset(self.get_queryset().prefetch_related(None)).values('id')
+        queryset = StockProduct.objects.filter(stock__in=stocks).order_by('stock_id', 'product_id')
+        columns = {'address': 'stock__address', 'product': 'product_id', 'quantity': 'quantity', 'price': 'price'}
+        return export_response(queryset, columns, request.query_params.get('output', 'csv'), 'positions')
+
+    @action(detail=True, methods=['post'], url_path='reserve', url_name='detail-reserve')
+    def reserve(self, request, pk=None):
+        """Списывает quantity продукта product со склада, 409 - если товара не хватает"""
+        serializer = ReservationSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        reservations.reserve(pk, serializer.validated_data['product'], serializer.validated_data['quantity'])
+        return Response(serializer.data)
+
+    @action(detail=True, methods=['post'])
+    def release(self, request, pk=None):
+        """Возвращает на склад quantity продукта product, например при отмене заказа"""
+        serializer = ReservationSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        reservations.release(pk, serializer.validated_data['product'], serializer.validated_data['quantity'])
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['post'], url_path='reserve', url_name='batch-reserve')
+    def reserve_batch(self, request):
+        """Резерв заказа из нескольких строк {stock, product, quantity}: все строки или ни одной"""
+        serializer = BatchReservationSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        reservations.reserve_batch(serializer.validated_data['items'])
+        return Response(serializer.data)
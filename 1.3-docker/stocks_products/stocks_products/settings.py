@@ -81,11 +81,44 @@ WSGI_APPLICATION = 'stocks_products.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': './stock.db',
+        'NAME': os.getenv('DB_NAME', './stock.db'),
+        # тестовая база в файле, а не в памяти: в общей in-memory базе SQLite потоки тестов
+        # получают "database table is locked" вместо ожидания блокировки
+        'TEST': {'NAME': os.getenv('DB_TEST_NAME', './test_stock.db')},
     }
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+# locmem - свой кэш у каждого процесса; если процессов несколько (gunicorn), задайте CACHE_DIR для общего файлового
+if os.getenv('CACHE_DIR'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.getenv('CACHE_DIR'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'stocks_products',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+
+# время жизни закэшированных ответов API logistic, секунды
+LOGISTIC_CACHE_TIMEOUT = int(os.getenv('LOGISTIC_CACHE_TIMEOUT', 300))
+
+# итоги складов из таблицы StockSummary вместо агрегации позиций на каждый запрос;
+# после включения заполните таблицу: python manage.py rebuild_stock_summary
+LOGISTIC_STOCK_SUMMARY = os.getenv('LOGISTIC_STOCK_SUMMARY', '0') == '1'
+# порог по умолчанию для /products/low-stock/
+LOGISTIC_LOW_STOCK_THRESHOLD = int(os.getenv('LOGISTIC_LOW_STOCK_THRESHOLD', 10))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
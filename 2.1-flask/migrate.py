@@ -0,0 +1,46 @@
+from sqlalchemy import text
+
+from models import Base, get_engine
+
+# версионированные миграции схемы: (версия, название, шаги); шаг - SQL или функция от соединения.
+# Применяются по порядку, номера примененных хранятся в таблице schema_version.
+# Запускается отдельным шагом перед стартом сервера: python migrate.py
+MIGRATIONS = [
+    (1, "initial schema", [lambda conn: Base.metadata.create_all(conn)]),
+    (2, "advertisements owner index", [
+        "CREATE INDEX IF NOT EXISTS ix_advertisements_owner_id_creation_time "
+        "ON advertisements (owner_id, creation_time, id)",
+    ]),
+]
+
+
+def migrate(engine=None) -> list[int]:
+    '''Применяет недостающие миграции в одной транзакции, возвращает номера примененных'''
+    engine = engine or get_engine()
+    applied_now = []
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_version ("
+            "version INTEGER PRIMARY KEY, name VARCHAR(200) NOT NULL, applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+        ))
+        if conn.dialect.name == "postgresql":
+            # параллельный запуск (несколько контейнеров) ждет, пока первый закончит
+            conn.execute(text("LOCK TABLE schema_version IN EXCLUSIVE MODE"))
+        applied = set(conn.execute(text("SELECT version FROM schema_version")).scalars())
+        for version, name, steps in MIGRATIONS:
+            if version in applied:
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(text(step))
+            conn.execute(text("INSERT INTO schema_version (version, name) VALUES (:version, :name)"),
+                         {"version": version, "name": name})
+            applied_now.append(version)
+    return applied_now
+
+
+if __name__ == "__main__":
+    applied = migrate()
+    print(f"applied migrations: {applied}" if applied else "schema is up to date")
@@ -1,8 +1,9 @@
 import datetime
+from dataclasses import dataclass
 import os
 import atexit
 
-from sqlalchemy import create_engine, DateTime, Integer, String, func, ForeignKey
+from sqlalchemy import create_engine, DateTime, Integer, String, func, ForeignKey, Index
 from sqlalchemy.orm import sessionmaker, DeclarativeBase, mapped_column, Mapped
 
 POSTGRES_USER = os.getenv("POSTGRES_USER")
@@ -11,11 +12,23 @@ POSTGRES_DB = os.getenv("POSTGRES_DB", "netology_flask")
 POSTGRES_HOST = os.getenv("POSTGRES_HOST", "127.0.0.1")
 POSTGRES_PORT = os.getenv("POSTGRES_PORT", "5431")
 
+# размер страницы GET /user/<id>/ads по умолчанию и максимальный
+ADS_PAGE_SIZE = int(os.getenv("ADS_PAGE_SIZE", 20))
+MAX_ADS_PAGE_SIZE = int(os.getenv("MAX_ADS_PAGE_SIZE", 100))
+
 PG_DSN = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
 
-engine = create_engine(PG_DSN)
-atexit.register(engine.dispose)
-Session = sessionmaker(bind=engine)
+# движок создается при первом обращении (get_engine), а не при импорте; схему создает migrate.py
+engine = None
+Session = sessionmaker()
+
+def get_engine():
+    global engine
+    if engine is None:
+        engine = create_engine(PG_DSN)
+        atexit.register(engine.dispose)
+        Session.configure(bind=engine)
+    return engine
 
 class Base(DeclarativeBase):
 
@@ -37,11 +50,15 @@ class User(Base):
         return {
             'id': self.id,
             'name': self.name,
-            'registration_time': self.registration_time.isoformat()
+            'registration_time': self.registration_time
         }
 
 class Advertisement(Base):
     __tablename__ = "advertisements"
+    __table_args__ = (
+        # объявления пользователя от новых к старым; id - для однозначного порядка при равном времени
+        Index("ix_advertisements_owner_id_creation_time", "owner_id", "creation_time", "id"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     title: Mapped[str] = mapped_column(String(100), nullable=False)
@@ -55,8 +72,18 @@ class Advertisement(Base):
             'id': self.id,
             'title': self.title,
             'description': self.description,
-            'creation_time': self.creation_time.isoformat(),
+            'creation_time': self.creation_time,
             'owner_id': self.owner_id
         }
 
-Base.metadata.create_all(bind=engine)
\ No newline at end of file
+@dataclass(slots=True)
+class AdvertisementRow:
+    '''Объявление в списках: читаются только колонки, без объекта ORM, а orjson сериализует dataclass
+    со __slots__ сам, без промежуточного словаря на строку. Поля - те же, что в Advertisement.to_dict'''
+    id: int
+    title: str
+    description: str
+    creation_time: datetime.datetime
+    owner_id: int
+
+ADVERTISEMENT_ROW_COLUMNS = tuple(getattr(Advertisement, name) for name in AdvertisementRow.__slots__)
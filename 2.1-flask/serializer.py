@@ -0,0 +1,56 @@
+import dataclasses
+import datetime
+import json
+import os
+
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# JSON_BACKEND=json принудительно включает стандартный json, даже если orjson установлен
+JSON_BACKEND = os.getenv("JSON_BACKEND", "orjson" if orjson else "json")
+
+
+def default(obj):
+    '''Модели отдаются сериализатору как есть, без предварительного списка словарей.
+    Строки-dataclass (AdvertisementRow) orjson пишет сам и сюда не передает, стандартный json - передает'''
+    if hasattr(obj, "to_dict"):
+        return obj.to_dict
+    if dataclasses.is_dataclass(obj):
+        return {field.name: getattr(obj, field.name) for field in dataclasses.fields(obj)}
+    if isinstance(obj, datetime.datetime):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps_orjson(data) -> bytes:
+    return orjson.dumps(data, default=default)
+
+
+def dumps_json(data) -> bytes:
+    return json.dumps(data, default=default, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+SERIALIZERS = {"json": dumps_json}
+if orjson:
+    SERIALIZERS["orjson"] = dumps_orjson
+
+dumps = SERIALIZERS[JSON_BACKEND]
+loads = orjson.loads if JSON_BACKEND == "orjson" else json.loads
+
+
+class FastJSONProvider(JSONProvider):
+    '''JSON-провайдер Flask поверх dumps/loads: jsonify и request.json работают через выбранный бэкенд'''
+
+    def dumps(self, obj, **kwargs) -> str:
+        return dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj), mimetype="application/json")
@@ -1,15 +1,22 @@
-from flask import Flask, jsonify, request, g
+import datetime
+
+from flask import Blueprint, Flask, jsonify, request, g, send_file, current_app
 from flask.views import MethodView
+from sqlalchemy import delete, select, tuple_
 from sqlalchemy.exc import IntegrityError
 from pydantic import ValidationError
 from flask_bcrypt import Bcrypt
 from functools import wraps
 
-from models import Session, User, Advertisement
+from models import (Session, User, Advertisement, AdvertisementRow, ADVERTISEMENT_ROW_COLUMNS,
+                    ADS_PAGE_SIZE, MAX_ADS_PAGE_SIZE, get_engine)
 from scheme import CreateUser, UpdateUser, CreateAdvertisement, UpdateAdvertisement
+from serializer import FastJSONProvider
+from profiling import ProfileStore, ProfilerMiddleware, track_sql, is_admin, PROFILE_HEADER
 
-app = Flask("test_server")
-bcrypt = Bcrypt(app)
+# маршруты собраны в blueprint, само приложение создает create_app
+api = Blueprint("api", __name__)
+bcrypt = Bcrypt()
 
 def hash_password(password: str):
     password_bytes = password.encode()
@@ -40,7 +47,7 @@ class HttpError(Exception):
         self.message = message
 
 
-@app.errorhandler(HttpError)
+@api.app_errorhandler(HttpError)
 def error_handler(error : HttpError):
     response = jsonify({"error": error.message})
     response.status_code = error.status_code
@@ -55,12 +62,12 @@ def validate(scheme_cls: type[CreateUser] | type[UpdateUser], json_data):
             error.pop("ctx", None)
         raise HttpError(400, errors)
 
-@app.before_request
+@api.before_app_request
 def before_request():
     session = Session()
     request.session = session
 
-@app.after_request
+@api.after_app_request
 def after_request(http_response):
     request.session.close()
     return http_response
@@ -105,14 +112,47 @@ class UserView(MethodView):
 
     def delete(self, user_id):
         user = get_user_by_id(user_id)
+        # объявления пользователя удаляются одним запросом в той же транзакции
+        request.session.execute(delete(Advertisement).where(Advertisement.owner_id == user.id))
         request.session.delete(user)
         request.session.commit()
         return jsonify({"status": "deleted"})
 
 user_view = UserView.as_view("user")
 
-app.add_url_rule("/user/<int:user_id>", view_func=user_view, methods=["GET", "PATCH", "DELETE"])
-app.add_url_rule("/user", view_func=user_view, methods=["POST"])
+api.add_url_rule("/user/<int:user_id>", view_func=user_view, methods=["GET", "PATCH", "DELETE"])
+api.add_url_rule("/user", view_func=user_view, methods=["POST"])
+
+def ads_cursor(ad: AdvertisementRow) -> str:
+    return f"{ad.creation_time.isoformat()}_{ad.id}"
+
+def parse_ads_cursor(cursor: str) -> tuple[datetime.datetime, int]:
+    try:
+        creation_time, _, ad_id = cursor.rpartition("_")
+        return datetime.datetime.fromisoformat(creation_time), int(ad_id)
+    except ValueError:
+        raise HttpError(400, "invalid cursor")
+
+@api.route("/user/<int:user_id>/ads", methods=["GET"])
+def user_ads(user_id):
+    """Объявления пользователя от новых к старым, страница после ключа (creation_time, id) из ?cursor=.
+    Читается по индексу ix_advertisements_owner_id_creation_time без OFFSET"""
+    # type=int молча подставил бы значение по умолчанию вместо ответа 400, как в 2.3-aiohttp
+    try:
+        limit = int(request.args.get("limit", ADS_PAGE_SIZE))
+    except ValueError:
+        raise HttpError(400, "limit must be an integer")
+    if not 1 <= limit <= MAX_ADS_PAGE_SIZE:
+        raise HttpError(400, f"limit must be between 1 and {MAX_ADS_PAGE_SIZE}")
+    get_user_by_id(user_id)
+    qs = (select(*ADVERTISEMENT_ROW_COLUMNS).where(Advertisement.owner_id == user_id)
+          .order_by(Advertisement.creation_time.desc(), Advertisement.id.desc()).limit(limit + 1))
+    cursor = request.args.get("cursor")
+    if cursor:
+        qs = qs.where(tuple_(Advertisement.creation_time, Advertisement.id) < tuple_(*parse_ads_cursor(cursor)))
+    ads = [AdvertisementRow(*row) for row in request.session.execute(qs)]
+    next_cursor = ads_cursor(ads[limit - 1]) if len(ads) > limit else None
+    return jsonify({"ads": ads[:limit], "next": next_cursor})
 
 def auth_required(f):
     @wraps(f)
@@ -133,8 +173,9 @@ def auth_required(f):
 class AdvertisementView(MethodView):
     def get(self, ad_id=None):
         if ad_id is None:
-            ads = request.session.query(Advertisement).all()
-            return jsonify([ad.to_dict for ad in ads])
+            # только колонки, без объектов ORM: AdvertisementRow сериализуется без словаря на строку
+            ads = [AdvertisementRow(*row) for row in request.session.execute(select(*ADVERTISEMENT_ROW_COLUMNS))]
+            return jsonify(ads)
         ad = request.session.get(Advertisement, ad_id)
         if not ad:
             raise HttpError(404, "Advertisement not found")
@@ -174,10 +215,10 @@ class AdvertisementView(MethodView):
 
 ad_view = AdvertisementView.as_view("advertisement")
 
-app.add_url_rule("/ads", view_func=ad_view, methods=["GET", "POST"])
-app.add_url_rule("/ads/<int:ad_id>", view_func=ad_view, methods=["GET", "PATCH", "DELETE"])
+api.add_url_rule("/ads", view_func=ad_view, methods=["GET", "POST"])
+api.add_url_rule("/ads/<int:ad_id>", view_func=ad_view, methods=["GET", "PATCH", "DELETE"])
 
-@app.route('/login', methods=['POST'])
+@api.route('/login', methods=['POST'])
 def login():
     json_data = request.json
     name = json_data.get('name')
@@ -192,4 +233,42 @@ def login():
 
     # Используем пароль как токен для упрощения
     return jsonify({"token": user.password})
-app.run()
\ No newline at end of file
+
+def get_profile_store() -> ProfileStore:
+    if not is_admin(request.headers.get(PROFILE_HEADER)):
+        raise HttpError(403, "Admin token required")
+    return current_app.extensions["profiles"]
+
+@api.route("/profiles", methods=["GET"])
+def list_profiles():
+    """Сохраненные профили запросов от новых к старым"""
+    return jsonify(get_profile_store().summaries())
+
+@api.route("/profiles/<profile_id>", methods=["GET"])
+def get_profile(profile_id):
+    """Профиль целиком: статистика cProfile и SQL-запросы; ?format=prof - дамп pstats файлом"""
+    store = get_profile_store()
+    profile = store.get(profile_id)
+    if profile is None:
+        raise HttpError(404, "Profile not found")
+    if request.args.get("format") == "prof":
+        return send_file(store.path(profile_id, "prof"), mimetype="application/octet-stream",
+                         as_attachment=True, download_name=f"{profile_id}.prof")
+    return jsonify(profile)
+
+def create_app() -> Flask:
+    """Фабрика приложения: новое приложение с маршрутами api, движком БД и профилировщиком запросов.
+    Схема при старте не создается, ее готовит migrate.py.
+    Запуск: python server.py или flask --app server run (Flask сам находит create_app)"""
+    app = Flask("test_server")
+    app.json = FastJSONProvider(app)
+    bcrypt.init_app(app)
+    app.register_blueprint(api)
+    get_engine()
+    app.extensions["profiles"] = ProfileStore()
+    app.wsgi_app = ProfilerMiddleware(app.wsgi_app, app.extensions["profiles"])
+    track_sql()
+    return app
+
+if __name__ == "__main__":
+    create_app().run()
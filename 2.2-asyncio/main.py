@@ -2,6 +2,7 @@ import asyncio
 import aiohttp
 import datetime
 from more_itertools import chunked
+from sqlalchemy.dialects.postgresql import insert
 from models import init_orm, close_orm, Session, SwapiPeople
 
 MAX_COROUTINES = 5
@@ -36,12 +37,17 @@ async def get_hero(hero_id, session):
     return response
 
 async def insert_people(data: list[dict]):
-    '''Добавляем информацию о героях в БД'''
+    '''Добавляем информацию о героях в БД, уже загруженных героев обновляем'''
+    rows = [d for d in data if d is not None]
+    if not rows:
+        return
+    stmt = insert(SwapiPeople).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[SwapiPeople.id],
+        set_={name: stmt.excluded[name] for name in rows[0] if name != 'id'},
+    )
     async with Session() as session:
-        for d in data:
-            if d is None:
-                continue
-            session.add(SwapiPeople(**d))
+        await session.execute(stmt)
         await session.commit()
 
 async def main():
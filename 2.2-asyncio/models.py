@@ -40,8 +40,8 @@ class SwapiPeople(Base):
     starships: Mapped[str] = mapped_column(String, nullable=True)
 
 async def init_orm():
+    # таблицы не пересоздаются: create_all пропускает существующие, повторная загрузка обновляет строки по id
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.drop_all)
         await conn.run_sync(Base.metadata.create_all)
 
 async def close_orm():
@@ -0,0 +1,143 @@
+import asyncio
+import datetime
+import os
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.orm import Session as SyncSession
+
+from models import Base, User, Advertisement, AdvertisementRow, Token, close_orm, get_engine
+from server import user_by_name_qs, token_by_id_qs
+from serializer import SERIALIZERS
+
+ITERATIONS = 2000
+TOKEN_ID = uuid.UUID(hex='f' * 32)
+
+
+def cpu_time_per_call(func, iterations=ITERATIONS):
+    '''Среднее процессорное время одного вызова в микросекундах'''
+    start = time.process_time()
+    for _ in range(iterations):
+        func()
+    return (time.process_time() - start) / iterations * 1_000_000
+
+
+def bench_queries():
+    '''Сравнивает горячие запросы сервера с тем, как их выполнял сервер до lambda_stmt: те же запросы, что
+    в прежнем коде (select на каждый вызов, session.get для токена), на движке с настройками по умолчанию,
+    то есть с включенным кэшем компиляции. Как и на сервере, у каждого вызова своя сессия. Список объявлений
+    не сравнивается: select(Advertisement) был и остается тем же запросом.
+    Postgres не нужен - запросы идут в sqlite в памяти, поэтому prepared statements asyncpg здесь
+    не учитываются, только CPU на стороне SQLAlchemy'''
+    tables = [User.__table__, Advertisement.__table__, Token.__table__]
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine, tables=tables)
+    with SyncSession(engine) as session:
+        session.add(User(id=1, name='user_1', email='user_1@test.com', password='password'))
+        session.add_all(Advertisement(title=f'title{i}', description='description', owner_id=1) for i in range(10))
+        session.add(Token(id=TOKEN_ID, user_id=1))
+        session.commit()
+
+    queries = {
+        'login': (
+            lambda session: session.execute(select(User).where(User.name == 'user_1')).scalars().first(),
+            lambda session: session.execute(user_by_name_qs('user_1')).scalars().first(),
+        ),
+        # прежний сервер не проверял срок токена, новый проверяет его в том же запросе
+        'token': (
+            lambda session: session.get(Token, TOKEN_ID),
+            lambda session: session.execute(token_by_id_qs(TOKEN_ID)).scalars().first(),
+        ),
+    }
+
+    def per_session(query):
+        with SyncSession(engine) as session:
+            return query(session)
+
+    for name, (before, after) in queries.items():
+        results = {mode: cpu_time_per_call(lambda: per_session(query))
+                   for mode, query in (('before', before), ('after', after))}
+        print(f"{name:>6}: before {results['before']:8.1f} us, after {results['after']:8.1f} us")
+
+
+def bench_serializers(ads_count=10_000, iterations=20):
+    '''Время сериализации ответа GET /ad со списком из ads_count объявлений для каждого доступного бэкенда:
+    объекты ORM через to_dict (как раньше) и строки AdvertisementRow (как сейчас)'''
+    now = datetime.datetime.now()
+    shapes = {
+        'orm': [
+            Advertisement(id=i, title=f'title{i}', description='description ' * 10, creation_time=now, owner_id=1)
+            for i in range(ads_count)
+        ],
+        'rows': [AdvertisementRow(i, f'title{i}', 'description ' * 10, now, 1) for i in range(ads_count)],
+    }
+    for name, dumps in SERIALIZERS.items():
+        for shape, ads in shapes.items():
+            per_call = cpu_time_per_call(lambda: dumps(ads), iterations) / 1000
+            print(f"{name:>6} {shape:>4}: {per_call:8.1f} ms per {ads_count} ads, {len(dumps(ads)) / 1024:.0f} KiB")
+
+
+# cold start воркера: новый процесс импортирует server, собирает приложение и выполняет его startup
+# (cleanup_ctx) - до этого момента воркер не принимает запросы
+STARTUP_CODE = '''
+import asyncio, time
+start = time.perf_counter()
+from aiohttp import web
+import server
+
+async def main():
+    runner = web.AppRunner(server.get_app())
+    await runner.setup()
+    ready = time.perf_counter() - start
+    await runner.cleanup()
+    return ready
+
+print(asyncio.run(main()))
+'''
+
+
+def boot_time(directory: str) -> float:
+    result = subprocess.run([sys.executable, '-c', STARTUP_CODE], capture_output=True, text=True,
+                            check=True, cwd=directory)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+async def drop_schema():
+    '''Удаляет таблицы приложения и schema_version: следующий старт идет на пустой базе'''
+    async with get_engine().begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.execute(text('DROP TABLE IF EXISTS schema_version'))
+    await close_orm()
+
+
+def bench_startup(baseline_dir: str, runs=5):
+    '''Cold start одного воркера на базе из POSTGRES_* (нужна отдельная база: таблицы удаляются).
+    before - сервер из baseline_dir, копии проекта до переноса DDL в migrate.py (например, git worktree
+    с коммита до этого изменения): init_orm выполняет CREATE EXTENSION и create_all на каждом старте.
+    Первый старт before идет на пустой базе и создает схему, поэтому показан отдельно от медианы.
+    after - текущий код: база снова очищается, схему один раз создает migrate.py (время показано отдельно)'''
+    here = os.path.dirname(os.path.abspath(__file__))
+    asyncio.run(drop_schema())
+    first = boot_time(baseline_dir)
+    before = [boot_time(baseline_dir) for _ in range(runs)]
+
+    asyncio.run(drop_schema())
+    start = time.perf_counter()
+    subprocess.run([sys.executable, 'migrate.py'], capture_output=True, check=True, cwd=here)
+    migrate_time = time.perf_counter() - start
+    after = [boot_time(here) for _ in range(runs)]
+    print(f"startup: before {statistics.median(before) * 1000:8.1f} ms (first boot on an empty database "
+          f"{first * 1000:.1f} ms), after {statistics.median(after) * 1000:8.1f} ms "
+          f"(migrate.py once {migrate_time * 1000:.1f} ms)")
+
+
+if __name__ == '__main__':
+    bench_queries()
+    bench_serializers()
+    # python bench.py <каталог проекта до переноса DDL> - еще и cold start воркера, см. bench_startup
+    if len(sys.argv) > 1:
+        bench_startup(sys.argv[1])
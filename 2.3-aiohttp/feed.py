@@ -0,0 +1,188 @@
+import asyncio
+import contextlib
+import json
+import logging
+import os
+
+import asyncpg
+from aiohttp import web
+from sqlalchemy import func, select
+
+from models import PG_DSN, Advertisement, Session, get_engine
+from serializer import dumps
+
+# сколько событий может ждать отправки одному клиенту; кто отстал сильнее, отключается
+FEED_QUEUE_SIZE = int(os.getenv("FEED_QUEUE_SIZE", 100))
+# пустой комментарий раз в FEED_KEEPALIVE секунд, чтобы прокси не закрывали простаивающий поток
+FEED_KEEPALIVE = float(os.getenv("FEED_KEEPALIVE", 15))
+# FEED_NOTIFY=1 - события ходят через Postgres LISTEN/NOTIFY и доходят до клиентов всех воркеров
+FEED_NOTIFY = os.getenv("FEED_NOTIFY", "0") == "1"
+FEED_CHANNEL = os.getenv("FEED_CHANNEL", "ad_events")
+FEED_RECONNECT_DELAY = 5
+
+logger = logging.getLogger(__name__)
+
+DROPPED = b'event: dropped\ndata: {"error": "client is too slow, reload GET /ad and reconnect"}\n\n'
+KEEPALIVE = b": keep-alive\n\n"
+
+
+def sse_event(event_type: str, data: bytes | str) -> bytes:
+    if isinstance(data, str):
+        data = data.encode()
+    return b"event: " + event_type.encode() + b"\ndata: " + data + b"\n\n"
+
+
+class AdFeed:
+    '''Pub/sub изменений объявлений внутри процесса: у каждого клиента своя очередь на FEED_QUEUE_SIZE событий.
+    Событие кодируется один раз и раздается всем очередям; клиент с переполненной очередью отключается,
+    его очередь очищается, чтобы не держать память'''
+
+    def __init__(self, queue_size: int = FEED_QUEUE_SIZE, notify: bool = FEED_NOTIFY):
+        self.queue_size = queue_size
+        self.notify = notify
+        self.subscribers: set[asyncio.Queue] = set()
+        self.dropped = 0
+
+    def subscribe(self) -> asyncio.Queue:
+        # +2 места под DROPPED и None, которые кладутся в уже очищенную очередь
+        queue = asyncio.Queue(self.queue_size + 2)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+
+    def disconnect(self, queue: asyncio.Queue, last_event: bytes | None = None):
+        self.unsubscribe(queue)
+        while not queue.empty():
+            queue.get_nowait()
+        # last_event - последнее событие клиенту, None - сигнал потоку закрыться
+        if last_event is not None:
+            queue.put_nowait(last_event)
+        queue.put_nowait(None)
+
+    def drop(self, queue: asyncio.Queue):
+        self.dropped += 1
+        self.disconnect(queue, DROPPED)
+
+    def close(self):
+        '''Закрывает потоки всех клиентов, чтобы остановка сервера не ждала их отключения'''
+        for queue in list(self.subscribers):
+            self.disconnect(queue)
+
+    def publish_local(self, event: bytes):
+        for queue in list(self.subscribers):
+            if queue.qsize() >= self.queue_size:
+                self.drop(queue)
+            else:
+                queue.put_nowait(event)
+
+    async def publish(self, event_type: str, ad: dict):
+        '''Вызывается после commit, поэтому ошибки только логируются: сбой ленты не должен превращать
+        сохраненную запись в ответ 500. С FEED_NOTIFY в Postgres уходит только {type, id} (payload NOTIFY
+        ограничен 8000 байт), объявление читают из БД слушатели всех воркеров, включая этот.
+        Иначе событие раздается клиентам текущего процесса'''
+        try:
+            if not self.notify:
+                self.publish_local(sse_event(event_type, dumps({"type": event_type, "ad": ad})))
+                return
+            payload = json.dumps({"type": event_type, "id": ad["id"]})
+            async with get_engine().begin() as conn:
+                await conn.execute(select(func.pg_notify(FEED_CHANNEL, payload)))
+        except Exception:
+            logger.exception("feed: cannot publish %s of ad %s", event_type, ad.get("id"))
+
+    async def publish_notification(self, payload: str):
+        '''Событие из NOTIFY: created и updated отдаются с текущим состоянием объявления из БД'''
+        notification = json.loads(payload)
+        event_type, ad_id = notification["type"], notification["id"]
+        if event_type == "deleted":
+            ad = {"id": ad_id}
+        else:
+            async with Session() as session:
+                ad = await session.get(Advertisement, ad_id)
+            if ad is None:
+                # объявление успели удалить, событие deleted придет следом
+                return
+            ad = ad.to_dict
+        self.publish_local(sse_event(event_type, dumps({"type": event_type, "ad": ad})))
+
+
+async def process_notifications(feed: AdFeed, notifications: asyncio.Queue):
+    '''Уведомления обрабатываются по одному, чтобы события доходили до клиентов в порядке NOTIFY'''
+    while True:
+        payload = await notifications.get()
+        try:
+            await feed.publish_notification(payload)
+        except Exception:
+            logger.exception("feed: cannot deliver notification %s", payload)
+
+
+async def listen_notifications(notifications: asyncio.Queue):
+    '''Отдельное соединение asyncpg слушает FEED_CHANNEL и складывает payload в очередь; при обрыве переподключается'''
+    dsn = PG_DSN.replace("postgresql+asyncpg://", "postgresql://")
+    while True:
+        try:
+            connection = await asyncpg.connect(dsn)
+        except (OSError, asyncpg.PostgresError) as err:
+            logger.warning("feed: cannot listen %s: %s", FEED_CHANNEL, err)
+            await asyncio.sleep(FEED_RECONNECT_DELAY)
+            continue
+        closed = asyncio.Event()
+        connection.add_termination_listener(lambda _: closed.set())
+        try:
+            await connection.add_listener(FEED_CHANNEL, lambda connection, pid, channel, payload: notifications.put_nowait(payload))
+            await closed.wait()
+        finally:
+            await connection.close()
+        await asyncio.sleep(FEED_RECONNECT_DELAY)
+
+
+async def feed_context(app: web.Application):
+    feed = app["feed"]
+    if not feed.notify:
+        yield
+        return
+    notifications = asyncio.Queue()
+    tasks = [
+        asyncio.create_task(listen_notifications(notifications)),
+        asyncio.create_task(process_notifications(feed, notifications)),
+    ]
+    yield
+    for task in tasks:
+        task.cancel()
+    for task in tasks:
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+
+async def feed_shutdown(app: web.Application):
+    app["feed"].close()
+
+
+async def ad_stream(request: web.Request):
+    '''GET /ad/stream: server-sent events created, updated, deleted с объявлением в data.
+    Отставший клиент получает событие dropped и отключается, после чего должен перечитать GET /ad'''
+    feed = request.config_dict["feed"]
+    response = web.StreamResponse(headers={
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+    await response.prepare(request)
+    queue = feed.subscribe()
+    try:
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), FEED_KEEPALIVE)
+            except asyncio.TimeoutError:
+                await response.write(KEEPALIVE)
+                continue
+            if event is None:
+                break
+            await response.write(event)
+    except ConnectionResetError:
+        pass
+    finally:
+        feed.unsubscribe(queue)
+    return response
@@ -0,0 +1,69 @@
+import asyncio
+
+from sqlalchemy import text
+
+from models import Base, get_engine, close_orm
+
+
+def create_extensions(conn):
+    # uuid_generate_v4() для tokens.id; в других СУБД расширений нет
+    if conn.dialect.name == "postgresql":
+        conn.exec_driver_sql('CREATE EXTENSION IF NOT EXISTS "uuid-ossp"')
+
+
+# версионированные миграции схемы: (версия, название, шаги); шаг - SQL или функция от синхронного соединения.
+# Применяются по порядку, номера примененных хранятся в таблице schema_version.
+# Запускается отдельным шагом перед стартом воркеров: python migrate.py
+MIGRATIONS = [
+    (1, "initial schema", [
+        create_extensions,
+        lambda conn: Base.metadata.create_all(conn),
+    ]),
+    (2, "tokens indexes", [
+        "CREATE INDEX IF NOT EXISTS ix_tokens_user_id_creation_time ON tokens (user_id, creation_time)",
+        "CREATE INDEX IF NOT EXISTS ix_tokens_creation_time ON tokens (creation_time)",
+    ]),
+    (3, "advertisements owner index", [
+        "CREATE INDEX IF NOT EXISTS ix_advertisements_owner_id_creation_time "
+        "ON advertisements (owner_id, creation_time, id)",
+    ]),
+]
+
+
+async def migrate(engine=None) -> list[int]:
+    '''Применяет недостающие миграции в одной транзакции, возвращает номера примененных'''
+    engine = engine or get_engine()
+    applied_now = []
+    async with engine.begin() as conn:
+        await conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_version ("
+            "version INTEGER PRIMARY KEY, name VARCHAR(200) NOT NULL, applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+        ))
+        if conn.dialect.name == "postgresql":
+            # параллельный запуск (несколько контейнеров) ждет, пока первый закончит
+            await conn.execute(text("LOCK TABLE schema_version IN EXCLUSIVE MODE"))
+        applied = set((await conn.execute(text("SELECT version FROM schema_version"))).scalars())
+        for version, name, steps in MIGRATIONS:
+            if version in applied:
+                continue
+            for step in steps:
+                if callable(step):
+                    await conn.run_sync(step)
+                else:
+                    await conn.execute(text(step))
+            await conn.execute(text("INSERT INTO schema_version (version, name) VALUES (:version, :name)"),
+                               {"version": version, "name": name})
+            applied_now.append(version)
+    return applied_now
+
+
+async def main():
+    try:
+        applied = await migrate()
+    finally:
+        await close_orm()
+    print(f"applied migrations: {applied}" if applied else "schema is up to date")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
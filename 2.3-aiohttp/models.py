@@ -1,10 +1,11 @@
 import datetime
+from dataclasses import dataclass
 import os
 from dotenv import load_dotenv
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncAttrs
 from sqlalchemy.orm import DeclarativeBase, mapped_column, Mapped, relationship
-from sqlalchemy import Integer, String, DateTime, ForeignKey,  func, text
+from sqlalchemy import Integer, String, DateTime, ForeignKey, Index, func
 
 
 load_dotenv()
@@ -17,8 +18,34 @@ POSTGRES_PORT = os.getenv("POSTGRES_PORT")
 
 PG_DSN = f"postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
 
-engine = create_async_engine(PG_DSN)
-Session = async_sessionmaker(engine, expire_on_commit=False)
+# размер кэша скомпилированных SQLAlchemy-запросов и кэша prepared statements asyncpg (на соединение)
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", 500))
+STATEMENT_CACHE_SIZE = int(os.getenv("STATEMENT_CACHE_SIZE", 100))
+
+# время жизни токена, лимит активных токенов на пользователя и параметры фоновой очистки
+TOKEN_TTL = datetime.timedelta(seconds=int(os.getenv("TOKEN_TTL", 24 * 60 * 60)))
+MAX_TOKENS_PER_USER = int(os.getenv("MAX_TOKENS_PER_USER", 10))
+TOKEN_PURGE_BATCH = int(os.getenv("TOKEN_PURGE_BATCH", 1000))
+TOKEN_PURGE_INTERVAL = int(os.getenv("TOKEN_PURGE_INTERVAL", 60))
+
+# размер страницы GET /user/{id}/ads по умолчанию и максимальный
+ADS_PAGE_SIZE = int(os.getenv("ADS_PAGE_SIZE", 20))
+MAX_ADS_PAGE_SIZE = int(os.getenv("MAX_ADS_PAGE_SIZE", 100))
+
+# движок создается при первом обращении (init_orm), а не при импорте; схему создает migrate.py
+engine = None
+Session = async_sessionmaker(expire_on_commit=False)
+
+def get_engine():
+    global engine
+    if engine is None:
+        engine = create_async_engine(
+            PG_DSN,
+            query_cache_size=QUERY_CACHE_SIZE,
+            connect_args={"prepared_statement_cache_size": STATEMENT_CACHE_SIZE},
+        )
+        Session.configure(bind=engine)
+    return engine
 
 class Base(DeclarativeBase, AsyncAttrs):
     pass
@@ -38,7 +65,7 @@ class User(Base):
         return {
             'id': self.id,
             'name': self.name,
-            'registration_time': self.registration_time.isoformat()
+            'registration_time': self.registration_time
         }
 
     @property
@@ -49,6 +76,10 @@ class User(Base):
 
 class Advertisement(Base):
     __tablename__ = "advertisements"
+    __table_args__ = (
+        # объявления пользователя от новых к старым; id - для однозначного порядка при равном времени
+        Index("ix_advertisements_owner_id_creation_time", "owner_id", "creation_time", "id"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     title: Mapped[str] = mapped_column(String(100), nullable=False)
@@ -62,7 +93,7 @@ class Advertisement(Base):
             'id': self.id,
             'title': self.title,
             'description': self.description,
-            'creation_time': self.creation_time.isoformat(),
+            'creation_time': self.creation_time,
             'owner_id': self.owner_id
         }
 
@@ -72,20 +103,34 @@ class Advertisement(Base):
             "id": self.id
         }
 
+@dataclass(slots=True)
+class AdvertisementRow:
+    '''Объявление в списках: читаются только колонки, без объекта ORM, а orjson сериализует dataclass
+    со __slots__ сам, без промежуточного словаря на строку. Поля - те же, что в Advertisement.to_dict'''
+    id: int
+    title: str
+    description: str
+    creation_time: datetime.datetime
+    owner_id: int
+
+ADVERTISEMENT_ROW_COLUMNS = tuple(getattr(Advertisement, name) for name in AdvertisementRow.__slots__)
+
 class Token(Base):
     __tablename__ = "tokens"
+    __table_args__ = (
+        Index("ix_tokens_user_id_creation_time", "user_id", "creation_time"),
+        Index("ix_tokens_creation_time", "creation_time"),
+    )
 
     id: Mapped[str] = mapped_column(UUID, primary_key=True, server_default=func.uuid_generate_v4())
     user_id: Mapped[int] = mapped_column(Integer, ForeignKey("app_users.id"))
     creation_time: Mapped[datetime.datetime] = mapped_column(DateTime, server_default=func.now())
 
 async def init_orm():
-    async with engine.begin() as conn:
-        async with Session() as session:
-            await session.execute(text('CREATE EXTENSION IF NOT EXISTS "uuid-ossp"'))
-            await session.commit()
-        # await conn.run_sync(Base.metadata.drop_all)
-        await conn.run_sync(Base.metadata.create_all)
+    get_engine()
 
 async def close_orm():
-    await engine.dispose()
\ No newline at end of file
+    global engine
+    if engine is not None:
+        await engine.dispose()
+        engine = None
\ No newline at end of file
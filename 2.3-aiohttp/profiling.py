@@ -0,0 +1,247 @@
+import asyncio
+import contextvars
+import cProfile
+import hmac
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import tempfile
+import threading
+import time
+
+from aiohttp import web
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Общая часть (до конца ProfileStore и save_profile) намеренно продублирована в 2.1-flask/profiling.py
+# и 2.3-aiohttp/profiling.py: проекты независимы и не имеют общего пакета. Правки вносить в обе копии.
+
+# профилирование по запросу: заголовок X-Profile-Token со значением PROFILE_TOKEN (без токена выключено)
+# или случайная выборка 1 из PROFILE_SAMPLE запросов (0 - выключено)
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_SAMPLE = int(os.getenv("PROFILE_SAMPLE", 0))
+# кольцевой буфер на диске: хранятся последние PROFILE_MAX_FILES профилей
+# по умолчанию у каждого проекта свой каталог: profiles-2.1-flask, profiles-2.3-aiohttp
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(
+    tempfile.gettempdir(), "profiles-" + os.path.basename(os.path.dirname(os.path.abspath(__file__)))))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", 100))
+# сколько строк статистики cProfile и SQL-запросов сохранять в профиле
+PROFILE_STATS_LINES = 40
+PROFILE_MAX_STATEMENTS = 200
+
+PROFILE_HEADER = "X-Profile-Token"
+# сами профили не профилируются, как и длинные потоки (SSE): они держали бы профилировщик и его блокировку
+# все время подключения. Потоки узнаются по пути (PROFILE_STREAM_PATHS через запятую, SSE /ad/stream
+# в 2.3-aiohttp) независимо от заголовков запроса, а также по Accept: text/event-stream
+PROFILE_URL_PREFIX = "/profiles"
+PROFILE_STREAM_PATHS = tuple(path for path in os.getenv("PROFILE_STREAM_PATHS", "/ad/stream").split(",") if path)
+EVENT_STREAM = "text/event-stream"
+PROFILE_ID_RE = re.compile(r"^\d+-\d+$")
+
+# SQL-запросы текущего запроса; None - запрос не профилируется
+_statements = contextvars.ContextVar("profile_statements", default=None)
+# cProfile не умеет профилировать два запроса одновременно, поэтому профиль снимается не более одного за раз.
+# В aiohttp профилировщик видит весь event loop: вызовы параллельных запросов тоже попадут в профиль
+_profile_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+def should_skip(path: str, accept: str | None) -> bool:
+    return path.startswith((PROFILE_URL_PREFIX, *PROFILE_STREAM_PATHS)) or accept == EVENT_STREAM
+
+
+def is_admin(token: str | None) -> bool:
+    return bool(PROFILE_TOKEN) and token is not None and hmac.compare_digest(token, PROFILE_TOKEN)
+
+
+def profile_reason(token: str | None) -> str | None:
+    if is_admin(token):
+        return "header"
+    if PROFILE_SAMPLE and random.randrange(PROFILE_SAMPLE) == 0:
+        return "sample"
+    return None
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _statements.get() is not None:
+        conn.info.setdefault("profile_start", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    statements = _statements.get()
+    if statements is not None and conn.info.get("profile_start"):
+        statements.append((statement, time.perf_counter() - conn.info["profile_start"].pop()))
+
+
+def track_sql():
+    '''Время SQL-запросов всех движков (в том числе sync_engine асинхронных); пока запрос не профилируется, обработчики ничего не делают'''
+    if not event.contains(Engine, "before_cursor_execute", before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+
+
+def sql_summary(statements: list[tuple[str, float]]) -> dict:
+    slowest = sorted(statements, key=lambda item: item[1], reverse=True)[:PROFILE_MAX_STATEMENTS]
+    return {
+        "count": len(statements),
+        "total_ms": sum(duration for _, duration in statements) * 1000,
+        "statements": [{"statement": statement, "ms": duration * 1000} for statement, duration in slowest],
+    }
+
+
+def stats_text(profiler: cProfile.Profile) -> str:
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(PROFILE_STATS_LINES)
+    return output.getvalue()
+
+
+class ProfileStore:
+    '''Профили на диске: {id}.json - описание запроса, SQL и текст статистики, {id}.prof - дамп pstats
+    (открывается pstats, snakeviz и т.п.). При превышении max_files удаляются самые старые'''
+
+    def __init__(self, directory: str = PROFILE_DIR, max_files: int = PROFILE_MAX_FILES):
+        self.directory = directory
+        self.max_files = max_files
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, profile_id: str, ext: str) -> str | None:
+        if not PROFILE_ID_RE.match(profile_id):
+            return None
+        return os.path.join(self.directory, f"{profile_id}.{ext}")
+
+    def save(self, profile: dict, profiler: cProfile.Profile) -> str:
+        profile_id = f"{time.time_ns()}-{os.getpid()}"
+        profile = {"id": profile_id, **profile, "stats": stats_text(profiler)}
+        profiler.dump_stats(self.path(profile_id, "prof"))
+        # json пишется последним и атомарно: профиль виден в списке только целиком
+        tmp_path = self.path(profile_id, "json") + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(profile, file)
+        os.replace(tmp_path, self.path(profile_id, "json"))
+        self.trim()
+        return profile_id
+
+    def ids(self) -> list[str]:
+        '''Идентификаторы от новых к старым'''
+        ids = [name[:-5] for name in os.listdir(self.directory) if name.endswith(".json")]
+        return sorted(ids, key=lambda profile_id: int(profile_id.split("-")[0]), reverse=True)
+
+    def trim(self):
+        with self._lock:
+            for profile_id in self.ids()[self.max_files:]:
+                for ext in ("json", "prof"):
+                    try:
+                        os.remove(self.path(profile_id, ext))
+                    except FileNotFoundError:
+                        pass
+
+    def get(self, profile_id: str) -> dict | None:
+        path = self.path(profile_id, "json")
+        if path is None:
+            return None
+        try:
+            with open(path) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def summaries(self) -> list[dict]:
+        '''Краткое описание профилей без статистики и текста запросов'''
+        profiles = []
+        for profile_id in self.ids():
+            profile = self.get(profile_id)
+            if profile is not None:
+                profile.pop("stats")
+                profile["sql"].pop("statements")
+                profiles.append(profile)
+        return profiles
+
+
+def save_profile(store: ProfileStore, profile: dict, profiler: cProfile.Profile) -> str | None:
+    '''Ошибка записи (нет места, нет прав) только логируется: профилирование не должно ломать сам запрос'''
+    try:
+        return store.save(profile, profiler)
+    except Exception:
+        logger.exception("cannot save profile of %s %s", profile.get("method"), profile.get("path"))
+        return None
+
+
+def get_http_error(error, message):
+    return error(text=json.dumps({"error": message}), content_type="application/json")
+
+
+@web.middleware
+async def profiling_middleware(request: web.Request, handler):
+    '''Снимает cProfile и время SQL для запросов с заголовком администратора или попавших в выборку,
+    в ответ добавляется заголовок X-Profile-Id'''
+    if should_skip(request.path, request.headers.get("Accept")):
+        return await handler(request)
+    reason = profile_reason(request.headers.get(PROFILE_HEADER))
+    if reason is None or not _profile_lock.acquire(blocking=False):
+        return await handler(request)
+
+    statements = []
+    token = _statements.set(statements)
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    response = None
+    profiler.enable()
+    try:
+        response = await handler(request)
+    except web.HTTPException as err:
+        # ошибки приложения (get_http_error) приходят исключениями, заголовок добавляется и к ним
+        response = err
+        raise
+    finally:
+        profiler.disable()
+        _statements.reset(token)
+        _profile_lock.release()
+        duration = time.perf_counter() - start
+        # запись на диск в пуле потоков, чтобы не блокировать event loop
+        profile_id = await asyncio.get_running_loop().run_in_executor(None, save_profile, request.app["profiles"], {
+            "method": request.method,
+            "path": request.path,
+            "query": request.query_string,
+            "status": response.status if response is not None else 500,
+            "reason": reason,
+            "time": time.time(),
+            "pid": os.getpid(),
+            "duration_ms": duration * 1000,
+            "sql": sql_summary(statements),
+        }, profiler)
+        if response is not None and profile_id is not None:
+            response.headers["X-Profile-Id"] = profile_id
+    return response
+
+
+def get_profile_store(request: web.Request) -> ProfileStore:
+    if not is_admin(request.headers.get(PROFILE_HEADER)):
+        raise get_http_error(web.HTTPForbidden, "admin token required")
+    return request.app["profiles"]
+
+
+async def profiles_view(request: web.Request):
+    '''Сохраненные профили запросов от новых к старым'''
+    store = get_profile_store(request)
+    return web.json_response(await asyncio.get_running_loop().run_in_executor(None, store.summaries))
+
+
+async def profile_view(request: web.Request):
+    '''Профиль целиком: статистика cProfile и SQL-запросы; ?format=prof - дамп pstats файлом'''
+    store = get_profile_store(request)
+    profile_id = request.match_info["profile_id"]
+    profile = await asyncio.get_running_loop().run_in_executor(None, store.get, profile_id)
+    if profile is None:
+        raise get_http_error(web.HTTPNotFound, "profile not found")
+    if request.query.get("format") == "prof":
+        return web.FileResponse(store.path(profile_id, "prof"), headers={
+            "Content-Type": "application/octet-stream",
+            "Content-Disposition": f'attachment; filename="{profile_id}.prof"',
+        })
+    return web.json_response(profile)
@@ -1,14 +1,47 @@
 from aiohttp import web
 from sqlalchemy.sql.functions import session_user
 
-from models import init_orm, close_orm, Session, User, Advertisement, Token
-import json
+from models import (init_orm, close_orm, Session, User, Advertisement, AdvertisementRow, Token,
+                    ADVERTISEMENT_ROW_COLUMNS,
+                    TOKEN_TTL, MAX_TOKENS_PER_USER, TOKEN_PURGE_BATCH, TOKEN_PURGE_INTERVAL,
+                    ADS_PAGE_SIZE, MAX_ADS_PAGE_SIZE)
+from serializer import dumps
+from sqlalchemy import lambda_stmt, delete, func, literal, tuple_, Interval
 from sqlalchemy.exc import IntegrityError
 from bcrypt import hashpw, checkpw, gensalt
 from functools import wraps
 from sqlalchemy.future import select
 from typing import Type, Callable, Awaitable
+import asyncio
+import contextlib
+import datetime
+import logging
+import os
 
+from workers import Metrics, metrics_middleware, metrics_view, run_workers
+from profiling import ProfileStore, profiling_middleware, profiles_view, profile_view, track_sql
+from feed import AdFeed, ad_stream, feed_context, feed_shutdown
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", 8080))
+WORKERS = int(os.getenv("WORKERS", 1))
+
+logger = logging.getLogger(__name__)
+
+
+# горячие запросы: lambda_stmt строит и компилирует SQL один раз, дальше меняются только параметры,
+# а asyncpg переиспользует prepared statement из кэша соединения
+def user_by_name_qs(name: str):
+    return lambda_stmt(lambda: select(User).where(User.name == name))
+
+# токены, выпущенные раньше этого момента, считаются просроченными (время берется на стороне БД)
+TOKEN_EXPIRED_BEFORE = func.now() - literal(TOKEN_TTL, Interval)
+
+def token_by_id_qs(token_id: str):
+    return lambda_stmt(lambda: select(Token).where(Token.id == token_id, Token.creation_time > TOKEN_EXPIRED_BEFORE))
+
+# списки объявлений читают только колонки AdvertisementRow, без объектов ORM
+ALL_ADS_QS = select(*ADVERTISEMENT_ROW_COLUMNS)
 
 
 def hash_password(password: str):
@@ -29,6 +62,31 @@ async def orm_context(app: web.Application):
     await close_orm()
     print("FINISH")
 
+async def purge_expired_tokens():
+    '''Удаляет просроченные токены пачками по TOKEN_PURGE_BATCH, чтобы не держать долгих блокировок'''
+    while True:
+        try:
+            async with Session() as session:
+                expired = select(Token.id).where(Token.creation_time < TOKEN_EXPIRED_BEFORE).limit(TOKEN_PURGE_BATCH)
+                result = await session.execute(delete(Token).where(Token.id.in_(expired)))
+                await session.commit()
+            purged = result.rowcount
+        except Exception:
+            # ошибка БД (failover, обрыв соединения) не должна навсегда останавливать очистку
+            logger.exception("token purge failed")
+            purged = 0
+        if purged < TOKEN_PURGE_BATCH:
+            await asyncio.sleep(TOKEN_PURGE_INTERVAL)
+        else:
+            await asyncio.sleep(0)
+
+async def token_purge_context(app: web.Application):
+    task = asyncio.create_task(purge_expired_tokens())
+    yield
+    task.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await task
+
 @web.middleware
 async def session_middleware(request: web.Request, handler):
     async with Session() as session:
@@ -42,7 +100,8 @@ async def auth_middleware(request: web.Request, handler):
     token_id = request.headers.get("token")
     if not token_id:
         raise get_http_error(web.HTTPUnauthorized, "Token empty")
-    token = await request.session.get(Token, token_id)
+    result = await request.session.execute(token_by_id_qs(token_id))
+    token = result.scalars().first()
     if not token:
         raise get_http_error(web.HTTPUnauthorized, "Token invalid")
     request.token = token
@@ -60,10 +119,13 @@ async def get_orm_item(item_class: Type[User] | Type[Token] | Type[Advertisement
     return item
 
 def get_http_error(error, message):
-    message = json.dumps({"error": message})
-    error = error(text=message, content_type='application/json')
+    message = dumps({"error": message})
+    error = error(body=message, content_type='application/json')
     raise error
 
+def json_response(data, status: int = 200) -> web.Response:
+    return web.Response(body=dumps(data), status=status, content_type='application/json')
+
 async def get_user_by_id(user_id: int, session: Session):
     user = await session.get(User, user_id)
     if user is None:
@@ -80,14 +142,45 @@ async def add_user(user: User, session: Session):
     session.add(Token(user_id=user.id))
     await session.commit()
 
+async def trim_user_tokens(user_id: int, session: Session):
+    '''Оставляет пользователю не больше MAX_TOKENS_PER_USER самых свежих токенов'''
+    newest = (select(Token.id).where(Token.user_id == user_id)
+              .order_by(Token.creation_time.desc()).limit(MAX_TOKENS_PER_USER))
+    await session.execute(delete(Token).where(Token.user_id == user_id, Token.id.not_in(newest)))
+
 async def delete_user(user: User, session: Session):
     await session.delete(user)
     await session.commit()
 
+async def delete_user_data(user_id: int, session: Session):
+    '''Объявления и токены пользователя - по одному DELETE на таблицу, в транзакции удаления пользователя'''
+    await session.execute(delete(Advertisement).where(Advertisement.owner_id == user_id))
+    await session.execute(delete(Token).where(Token.user_id == user_id))
+
+def ads_cursor(ad: AdvertisementRow) -> str:
+    return f"{ad.creation_time.isoformat()}_{ad.id}"
+
+def parse_ads_cursor(cursor: str) -> tuple[datetime.datetime, int]:
+    try:
+        creation_time, _, ad_id = cursor.rpartition("_")
+        return datetime.datetime.fromisoformat(creation_time), int(ad_id)
+    except ValueError:
+        raise get_http_error(web.HTTPBadRequest, "invalid cursor")
+
+async def get_user_ads(user_id: int, cursor: str | None, limit: int, session: Session):
+    '''Страница объявлений пользователя от новых к старым по ключу (creation_time, id) после cursor.
+    Читается по индексу ix_advertisements_owner_id_creation_time без OFFSET'''
+    qs = (select(*ADVERTISEMENT_ROW_COLUMNS).where(Advertisement.owner_id == user_id)
+          .order_by(Advertisement.creation_time.desc(), Advertisement.id.desc()).limit(limit + 1))
+    if cursor:
+        qs = qs.where(tuple_(Advertisement.creation_time, Advertisement.id) < tuple_(*parse_ads_cursor(cursor)))
+    ads = [AdvertisementRow(*row) for row in await session.execute(qs)]
+    next_cursor = ads_cursor(ads[limit - 1]) if len(ads) > limit else None
+    return ads[:limit], next_cursor
+
 async def get_ad_by_id(ad_id: int, session: Session):
     if ad_id is None:
-        ads = await session.execute(select(Advertisement))
-        ads = ads.scalars().all()
+        ads = [AdvertisementRow(*row) for row in await session.execute(ALL_ADS_QS)]
     else:
         ads = await session.get(Advertisement, ad_id)
     if ads is None:
@@ -118,14 +211,14 @@ class UserView(web.View):
 
     async def get(self):
         user = await get_user_by_id(self.user_id, self.session)
-        return web.json_response(user.to_dict)
+        return json_response(user.to_dict)
 
     async def post(self):
         json_data = await self.request.json()
         json_data['password'] = hash_password(json_data['password'])
         user = User(**json_data)
         await add_user(user, self.session)
-        return web.json_response(user.dict_id)
+        return json_response(user.dict_id)
 
     async def patch(self):
         print(f"Updating {self.user_id}")
@@ -137,12 +230,13 @@ class UserView(web.View):
         for key, value in json_data.items():
             setattr(user, key, value)
         await add_user(user, self.session)
-        return web.json_response(user.dict_id)
+        return json_response(user.dict_id)
 
     async def delete(self):
         user = await get_user_by_id(self.user_id, self.session)
+        await delete_user_data(user.id, self.session)
         await delete_user(user, self.session)
-        return web.json_response({"status": "success"})
+        return json_response({"status": "success"})
 
 
 class AdvertisementView(web.View):
@@ -158,19 +252,22 @@ class AdvertisementView(web.View):
     def session(self):
         return self.request.session
 
+    @property
+    def feed(self) -> AdFeed:
+        return self.request.config_dict["feed"]
+
     async def get(self):
         ads = await get_ad_by_id(self.ad_id, self.session)
-        return web.json_response([ad.to_dict for ad in ads])
+        return json_response(ads)
 
-    # @login_required
     async def post(self):
         json_data = await self.request.json()
-        owner_id = self.session['user_id']
-        ad = Advertisement(**json_data, owner_id=int(self.request.headers.get('Authorization')))
-                           # owner_id=self.session['user_id'])
-                           # owner_id=int(self.request.headers.get('Authorization')))
+        # владелец - пользователь токена, проверенного auth_middleware, а не поле из тела запроса
+        json_data.pop('owner_id', None)
+        ad = Advertisement(**json_data, owner_id=self.request.token.user_id)
         await add_ad(ad, self.session)
-        return web.json_response(ad.dict_id)
+        await self.feed.publish("created", ad.to_dict)
+        return json_response(ad.dict_id)
 
     async def patch(self):
         ad = await get_ad_by_id(self.ad_id, self.session)
@@ -179,17 +276,30 @@ class AdvertisementView(web.View):
         for key, value in json_data.items():
             setattr(ad, key, value)
         await add_ad(ad, self.session)
-        return web.json_response(ad.dict_id)
+        await self.feed.publish("updated", ad.to_dict)
+        return json_response(ad.dict_id)
 
     async def delete(self):
         ad = await get_ad_by_id(self.ad_id, self.session)
         await delete_user(ad, self.session)
-        return web.json_response({"status": f"ad {self.ad_id} deleted successfully"})
+        await self.feed.publish("deleted", ad.dict_id)
+        return json_response({"status": f"ad {self.ad_id} deleted successfully"})
+
+async def user_ads(request: web.Request):
+    user_id = int(request.match_info["user_id"])
+    try:
+        limit = int(request.query.get("limit", ADS_PAGE_SIZE))
+    except ValueError:
+        raise get_http_error(web.HTTPBadRequest, "limit must be an integer")
+    if not 1 <= limit <= MAX_ADS_PAGE_SIZE:
+        raise get_http_error(web.HTTPBadRequest, f"limit must be between 1 and {MAX_ADS_PAGE_SIZE}")
+    await get_user_by_id(user_id, request.session)
+    ads, next_cursor = await get_user_ads(user_id, request.query.get("cursor"), limit, request.session)
+    return json_response({"ads": ads, "next": next_cursor})
 
 async def login(request: web.Request):
     login_data = await request.json()
-    qs = select(User).where(User.name == login_data["name"])
-    result = await request.session.execute(qs)
+    result = await request.session.execute(user_by_name_qs(login_data["name"]))
     user = result.scalars().first()
     if not user or not check_password(login_data["password"], user.password):
         raise get_http_error(web.HTTPUnauthorized, "incorrect login or password")
@@ -200,24 +310,38 @@ async def login(request: web.Request):
     # token = result.scalars().first()
     token = Token(user_id=user.id) ## много токенов на 1 пользователя
     request.session.add(token)
+    await request.session.flush()
+    await trim_user_tokens(user.id, request.session)
     await request.session.commit()
 
-    return web.json_response({"token": str(token.id)})
+    return json_response({"token": str(token.id)})
 
 
 
 
 
-if __name__ == "__main__":
-    app = web.Application(middlewares=[session_middleware])
+def get_app() -> web.Application:
+    app = web.Application(middlewares=[metrics_middleware, profiling_middleware, session_middleware])
     app_auth_required = web.Application(middlewares=[session_middleware, auth_middleware])
 
     app.cleanup_ctx.append(orm_context)
+    app.cleanup_ctx.append(token_purge_context)
+    app.cleanup_ctx.append(feed_context)
+    app.on_shutdown.append(feed_shutdown)
+    app["metrics"] = Metrics.create()
+    app["profiles"] = ProfileStore()
+    app["feed"] = AdFeed()
+    track_sql()
 
     app.add_routes([
         web.post("/user", UserView),
         web.get("/ad", AdvertisementView),
+        web.get("/ad/stream", ad_stream),
+        web.get("/user/{user_id:\d+}/ads", user_ads),
         web.post("/login", login),
+        web.get("/metrics", metrics_view),
+        web.get("/profiles", profiles_view),
+        web.get("/profiles/{profile_id}", profile_view),
     ])
 
     app_auth_required.add_routes([
@@ -231,5 +355,11 @@ if __name__ == "__main__":
     ])
     app.add_subapp(prefix="/user", subapp=app_auth_required)
     # app.add_subapp(prefix="/ad", subapp=app_auth_required)
+    return app
 
-    web.run_app(app)
+
+if __name__ == "__main__":
+    if WORKERS > 1:
+        run_workers(get_app, WORKERS, HOST, PORT)
+    else:
+        web.run_app(get_app(), host=HOST, port=PORT)
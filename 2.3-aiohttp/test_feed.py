@@ -0,0 +1,74 @@
+import asyncio
+import json
+import os
+import unittest
+import uuid
+
+from aiohttp.test_utils import AioHTTPTestCase
+
+import migrate
+import server
+
+# сколько ждать события в потоке, секунд
+EVENT_TIMEOUT = 5
+
+
+async def read_event(stream) -> tuple[str, dict]:
+    '''Следующее событие SSE без keep-alive комментариев: (тип, data)'''
+    event_type = None
+    while True:
+        line = (await stream.content.readline()).decode().rstrip("\n")
+        if line.startswith("event: "):
+            event_type = line[len("event: "):]
+        elif line.startswith("data: ") and event_type is not None:
+            return event_type, json.loads(line[len("data: "):])
+
+
+@unittest.skipUnless(os.getenv("POSTGRES_DB"), "нужна база Postgres из POSTGRES_*")
+class AdFeedTest(AioHTTPTestCase):
+    '''Изменения объявлений через API доходят до клиентов /ad/stream'''
+
+    async def get_application(self):
+        return server.get_app()
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        await migrate.migrate()
+        name = f"feed-{uuid.uuid4().hex[:8]}"
+        response = await self.client.post("/user", json={
+            "name": name, "email": f"{name}@example.com", "password": "12345678",
+        })
+        self.user_id = (await response.json())["id"]
+        response = await self.client.post("/login", json={"name": name, "password": "12345678"})
+        self.headers = {"token": (await response.json())["token"]}
+
+    async def asyncTearDown(self):
+        await self.client.delete(f"/user/{self.user_id}", headers=self.headers)
+        await super().asyncTearDown()
+
+    async def test_created_updated_deleted(self):
+        stream = await self.client.get("/ad/stream")
+        # владелец берется из токена, owner_id из тела игнорируется
+        response = await self.client.post("/user/ad", headers=self.headers, json={
+            "title": "Велосипед", "description": "Почти новый", "owner_id": 0,
+        })
+        self.assertEqual(response.status, 200)
+        ad_id = (await response.json())["id"]
+        event_type, data = await asyncio.wait_for(read_event(stream), EVENT_TIMEOUT)
+        self.assertEqual(event_type, "created")
+        self.assertEqual(data["ad"]["id"], ad_id)
+        self.assertEqual(data["ad"]["owner_id"], self.user_id)
+        self.assertEqual(data["ad"]["title"], "Велосипед")
+
+        await self.client.patch(f"/user/ad/{ad_id}", headers=self.headers, json={"title": "Самокат"})
+        event_type, data = await asyncio.wait_for(read_event(stream), EVENT_TIMEOUT)
+        self.assertEqual((event_type, data["ad"]["title"]), ("updated", "Самокат"))
+
+        await self.client.delete(f"/user/ad/{ad_id}", headers=self.headers)
+        event_type, data = await asyncio.wait_for(read_event(stream), EVENT_TIMEOUT)
+        self.assertEqual((event_type, data["ad"]), ("deleted", {"id": ad_id}))
+        stream.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from typing import Callable
+
+from aiohttp import web
+
+METRICS_FIELDS = ("requests", "errors", "time")
+
+
+class Metrics:
+    '''Счетчики запросов всех воркеров в общей памяти: у каждого воркера своя строка в массиве'''
+
+    def __init__(self, array, worker_id: int = 0):
+        self.array = array
+        self.worker_id = worker_id
+
+    @classmethod
+    def create(cls, workers: int = 1):
+        return cls(multiprocessing.get_context("spawn").Array("d", workers * len(METRICS_FIELDS)))
+
+    @property
+    def workers(self) -> int:
+        return len(self.array) // len(METRICS_FIELDS)
+
+    def for_worker(self, worker_id: int):
+        return Metrics(self.array, worker_id)
+
+    def add(self, duration: float, error: bool):
+        offset = self.worker_id * len(METRICS_FIELDS)
+        with self.array.get_lock():
+            self.array[offset] += 1
+            self.array[offset + 1] += int(error)
+            self.array[offset + 2] += duration
+
+    def to_dict(self):
+        with self.array.get_lock():
+            values = list(self.array)
+        workers = []
+        for worker_id in range(self.workers):
+            row = values[worker_id * len(METRICS_FIELDS):(worker_id + 1) * len(METRICS_FIELDS)]
+            workers.append({"worker": worker_id, **dict(zip(METRICS_FIELDS, row))})
+        total = {field: sum(worker[field] for worker in workers) for field in METRICS_FIELDS}
+        return {"total": total, "workers": workers}
+
+
+@web.middleware
+async def metrics_middleware(request: web.Request, handler):
+    start = time.perf_counter()
+    error = True
+    try:
+        response = await handler(request)
+        error = response.status >= 500
+        return response
+    except web.HTTPException as err:
+        error = err.status >= 500
+        raise
+    finally:
+        request.app["metrics"].add(time.perf_counter() - start, error)
+
+
+async def metrics_view(request: web.Request):
+    return web.json_response(request.app["metrics"].to_dict())
+
+
+def run_worker(app_factory: Callable[[], web.Application], metrics: Metrics, worker_id: int,
+               host: str, port: int, sock: socket.socket | None):
+    '''Точка входа процесса-воркера: свое приложение, свой движок и пул соединений'''
+    app = app_factory()
+    app["metrics"] = metrics.for_worker(worker_id)
+    print(f"worker {worker_id} pid {os.getpid()}")
+    if sock is not None:
+        web.run_app(app, sock=sock, print=None)
+    else:
+        web.run_app(app, host=host, port=port, reuse_port=True, print=None)
+
+
+def run_workers(app_factory: Callable[[], web.Application], workers: int, host: str = "0.0.0.0", port: int = 8080):
+    '''Запускает workers процессов на одном порту.
+    Если ОС поддерживает SO_REUSEPORT, каждый воркер слушает свой сокет и ядро раскидывает соединения,
+    иначе сокет открывается заранее и передается воркерам через fork'''
+    metrics = Metrics.create(workers)
+    if hasattr(socket, "SO_REUSEPORT"):
+        context = multiprocessing.get_context("spawn")
+        sock = None
+    else:
+        context = multiprocessing.get_context("fork")
+        sock = socket.create_server((host, port), reuse_port=False)
+        sock.set_inheritable(True)
+
+    processes = [
+        context.Process(target=run_worker, args=(app_factory, metrics, worker_id, host, port, sock), daemon=False)
+        for worker_id in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    print(f"======== Running on http://{host}:{port} ({workers} workers) ========")
+
+    def stop(signum, frame):
+        # run_app в воркере ловит SIGTERM и корректно отрабатывает cleanup_ctx (закрывает движок)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for process in processes:
+        process.join()
+    if sock is not None:
+        sock.close()
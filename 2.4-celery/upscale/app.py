@@ -0,0 +1,174 @@
+import io
+import json
+import mimetypes
+import os
+import time
+
+from celery.result import AsyncResult
+from flask import Flask, Request, Response, jsonify, request, stream_with_context, url_for
+
+from tasks import celery_app, result_store, content_key, submit, cancel, DEFAULT_MODEL, DEFAULT_SCALE
+from upscale import MODEL_SCALES, image_size
+
+MAX_UPLOAD_SIZE = int(os.getenv('MAX_UPLOAD_SIZE', 32 * 1024 * 1024))
+UPLOAD_CHUNK_SIZE = 64 * 1024
+EXTENSIONS = {'.png', '.jpg', '.jpeg', '.bmp', '.webp', '.tiff'}
+# как часто SSE-поток проверяет состояние задачи и как часто шлет keep-alive, секунды
+EVENTS_POLL_INTERVAL = float(os.getenv('EVENTS_POLL_INTERVAL', 0.5))
+EVENTS_KEEPALIVE = 15
+# дольше EVENTS_MAX_DURATION секунд поток не держится (он занимает поток WSGI-сервера), клиент переподключается
+EVENTS_MAX_DURATION = float(os.getenv('EVENTS_MAX_DURATION', 10 * 60))
+
+
+class InMemoryRequest(Request):
+    """Файлы из multipart читаются в память, а не во временный файл на диске"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return io.BytesIO()
+
+
+app = Flask('upscale')
+app.request_class = InMemoryRequest
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_SIZE
+
+
+class HttpError(Exception):
+
+    def __init__(self, status_code: int, message: str):
+        self.status_code = status_code
+        self.message = message
+
+
+@app.errorhandler(HttpError)
+def error_handler(error: HttpError):
+    response = jsonify({'error': error.message})
+    response.status_code = error.status_code
+    return response
+
+
+def get_extension(filename: str | None) -> str:
+    ext = os.path.splitext(filename or '')[1].lower() or '.png'
+    if ext not in EXTENSIONS:
+        raise HttpError(400, f'unsupported file type {ext}')
+    return ext
+
+
+def read_upload() -> tuple[memoryview, str]:
+    """Принимает multipart-поле file или сырое тело запроса с Content-Type image/*.
+    Возвращает представление буфера запроса без копирования"""
+    if 'file' in request.files:
+        file = request.files['file']
+        return file.stream.getbuffer(), get_extension(file.filename)
+    if request.mimetype.startswith('image/'):
+        buffer = io.BytesIO()
+        while chunk := request.stream.read(UPLOAD_CHUNK_SIZE):
+            buffer.write(chunk)
+        return buffer.getbuffer(), get_extension(mimetypes.guess_extension(request.mimetype))
+    raise HttpError(400, 'file is required')
+
+
+def get_model() -> tuple[str, int]:
+    model = request.values.get('model', DEFAULT_MODEL).lower()
+    try:
+        scale = int(request.values.get('scale', DEFAULT_SCALE))
+    except ValueError:
+        raise HttpError(400, 'scale must be an integer')
+    if scale not in MODEL_SCALES.get(model, ()):
+        raise HttpError(400, f'unknown model {model} x{scale}')
+    return model, scale
+
+
+@app.route('/upscale', methods=['POST'])
+def upscale():
+    data, ext = read_upload()
+    if not data:
+        raise HttpError(400, 'file is empty')
+    model, scale = get_model()
+    key = content_key(data, ext, model, scale)
+    if result_store.exists(key):
+        return jsonify({'task_id': key}), 200
+    try:
+        width, height = image_size(data)
+    except ValueError as err:
+        raise HttpError(400, str(err))
+    # то же изображение уже считается: присоединяемся к его задаче
+    task_id, created = submit(data, ext, model, scale, key, width * height)
+    return jsonify({'task_id': task_id}), 201 if created else 202
+
+
+def task_status(task_id: str) -> dict:
+    # результат из кэша отдается сразу, даже если запись о задаче в бэкенде Celery уже истекла
+    if result_store.exists(task_id):
+        return {
+            'task_id': task_id,
+            'status': 'SUCCESS',
+            'file': url_for('get_processed', file=task_id, _external=True),
+        }
+    task = AsyncResult(task_id, app=celery_app)
+    response = {'task_id': task_id, 'status': task.status}
+    if task.successful():
+        response['file'] = url_for('get_processed', file=task.result, _external=True)
+    elif task.status == 'PROGRESS':
+        response['progress'] = task.info
+    elif task.failed():
+        response['error'] = str(task.result)
+    return response
+
+
+@app.route('/tasks/<task_id>', methods=['GET'])
+def get_task(task_id):
+    return jsonify(task_status(task_id))
+
+
+@app.route('/tasks/<task_id>', methods=['DELETE'])
+def cancel_task(task_id):
+    status = task_status(task_id)['status']
+    if status in ('SUCCESS', 'FAILURE', 'REVOKED'):
+        raise HttpError(409, f'task is already {status}')
+    cancel(task_id)
+    return jsonify(task_status(task_id))
+
+
+@app.route('/tasks/<task_id>/events', methods=['GET'])
+def task_events(task_id):
+    """Server-sent events: новое событие при каждой смене состояния или прогресса, поток закрывается,
+    когда задача завершилась (SUCCESS, FAILURE, REVOKED) или через EVENTS_MAX_DURATION (событие timeout).
+    Отправленная задача всегда имеет состояние в бэкенде, PENDING означает неизвестный id"""
+    if task_status(task_id)['status'] == 'PENDING':
+        raise HttpError(404, 'task not found')
+
+    def events():
+        last_status = None
+        last_sent = time.monotonic()
+        deadline = last_sent + EVENTS_MAX_DURATION
+        while True:
+            status = task_status(task_id)
+            if status != last_status:
+                yield f'event: status\ndata: {json.dumps(status)}\n\n'
+                last_status = status
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent > EVENTS_KEEPALIVE:
+                yield ': keep-alive\n\n'
+                last_sent = time.monotonic()
+            if status['status'] in ('SUCCESS', 'FAILURE', 'REVOKED'):
+                return
+            if time.monotonic() > deadline:
+                yield 'event: timeout\ndata: {}\n\n'
+                return
+            time.sleep(EVENTS_POLL_INTERVAL)
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/processed/<file>', methods=['GET'])
+def get_processed(file):
+    data = result_store.get(file)
+    if data is None:
+        raise HttpError(404, 'file not found')
+    mimetype = mimetypes.guess_type(file)[0] or 'application/octet-stream'
+    return Response(data, mimetype=mimetype)
+
+
+if __name__ == '__main__':
+    app.run()
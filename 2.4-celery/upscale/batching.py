@@ -0,0 +1,141 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import cv2
+import numpy as np
+
+from upscale import MODEL_DIR, MODEL_FILES, TILE_SIZE, models, upscale_image
+
+# батч включается при BATCH_SIZE > 1; воркер должен выполнять задачи параллельно (--pool threads)
+BATCH_SIZE = int(os.getenv('BATCH_SIZE', 1))
+# сколько ждать добора батча после первого изображения, секунды
+BATCH_WAIT = float(os.getenv('BATCH_WAIT', 0.05))
+STATS_EVERY = int(os.getenv('BATCH_STATS_EVERY', 100))
+# средние значения BGR датасета DIV2K, их же вычитает DnnSuperResImpl для EDSR
+EDSR_MEAN = (103.1545782, 111.561547, 114.35629)
+
+logger = logging.getLogger(__name__)
+
+
+class BatchUpscaler:
+    """Собирает изображения из разных задач в батчи одной формы и прогоняет их через сеть одним forward.
+    Батч уходит в работу, когда набралось max_batch изображений или прошло max_wait с первого.
+    Пакетно обрабатывается только EDSR, у остальных моделей DnnSuperResImpl работает по одному изображению."""
+
+    def __init__(self, model: str = 'edsr', scale: int = 2, max_batch: int = BATCH_SIZE,
+                 max_wait: float = BATCH_WAIT, model_dir: str = MODEL_DIR):
+        self.model = model
+        self.scale = scale
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        if model == 'edsr':
+            self.net = cv2.dnn.readNet(os.path.join(model_dir, MODEL_FILES[model].format(scale=scale)))
+        else:
+            self.net = None
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+        self._thread = threading.Thread(target=self._run, name=f'upscale-batch-{model}-x{scale}', daemon=True)
+        self._thread.start()
+
+    def submit(self, image: np.ndarray) -> Future:
+        future = Future()
+        self._queue.put((image, future, time.perf_counter()))
+        return future
+
+    def upscale(self, image: np.ndarray) -> np.ndarray:
+        return self.submit(image).result()
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self._stats = {'batches': 0, 'images': 0, 'wait': 0.0, 'infer': 0.0}
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        images = stats['images'] or 1
+        return {
+            'batches': stats['batches'],
+            'images': stats['images'],
+            'mean_batch': stats['images'] / (stats['batches'] or 1),
+            'mean_wait_ms': stats['wait'] / images * 1000,
+            'infer_ms_per_image': stats['infer'] / images * 1000,
+            'images_per_s': stats['images'] / stats['infer'] if stats['infer'] else 0.0,
+        }
+
+    def _collect(self) -> list:
+        items = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(items) < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            started = time.perf_counter()
+            groups = {}
+            for item in items:
+                groups.setdefault(item[0].shape, []).append(item)
+            for group in groups.values():
+                try:
+                    results = self._forward([image for image, _, _ in group])
+                except Exception as err:
+                    for _, future, _ in group:
+                        future.set_exception(err)
+                    continue
+                for (_, future, _), result in zip(group, results):
+                    future.set_result(result)
+            self._record(items, started, time.perf_counter())
+
+    def _forward(self, images: list[np.ndarray]) -> list[np.ndarray]:
+        if self.net is None:
+            with models.borrow(self.model, self.scale) as scaler:
+                return [scaler.upsample(image) for image in images]
+        blob = cv2.dnn.blobFromImages(images, 1.0, None, EDSR_MEAN, swapRB=False, crop=False)
+        self.net.setInput(blob)
+        output = self.net.forward()
+        output += np.asarray(EDSR_MEAN, dtype=np.float32).reshape(1, 3, 1, 1)
+        output = np.clip(output, 0, 255).astype(np.uint8)
+        return [np.ascontiguousarray(item.transpose(1, 2, 0)) for item in output]
+
+    def _record(self, items: list, started: float, finished: float):
+        with self._stats_lock:
+            self._stats['batches'] += 1
+            self._stats['images'] += len(items)
+            self._stats['wait'] += sum(started - queued for _, _, queued in items)
+            self._stats['infer'] += finished - started
+            batches = self._stats['batches']
+        if STATS_EVERY and batches % STATS_EVERY == 0:
+            logger.info('batch %s x%s: %s', self.model, self.scale, self.stats())
+
+
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+
+def get_batcher(model: str = 'edsr', scale: int = 2) -> BatchUpscaler:
+    with _batchers_lock:
+        if (model, scale) not in _batchers:
+            _batchers[model, scale] = BatchUpscaler(model, scale)
+        return _batchers[model, scale]
+
+
+def upscale_batched(image: np.ndarray, model: str = 'edsr', scale: int = 2, progress=None) -> np.ndarray:
+    """То же, что upscale_image, но небольшие изображения идут через общий батч процесса"""
+    if BATCH_SIZE <= 1 or (TILE_SIZE and max(image.shape[:2]) > TILE_SIZE):
+        return upscale_image(image, model, scale, progress)
+    result = get_batcher(model, scale).upscale(image)
+    if progress is not None:
+        progress(1, 1)
+    return result
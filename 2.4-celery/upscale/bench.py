@@ -0,0 +1,222 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import resource
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from batching import BatchUpscaler
+from upscale import MAX_MODELS, TILE_SIZE, models, upscale_image, upscale_tiled
+
+
+def synthetic_image(width: int, height: int, seed: int = 0) -> np.ndarray:
+    """Гладкий градиент с шумом: похож на фото сильнее, чем чистый шум, и не требует файлов"""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    image = np.stack([np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width)), (x + y) / 2], axis=2)
+    image += rng.normal(0, 8, image.shape).astype(np.float32)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def parse_size(value: str) -> tuple[int, int]:
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+def cold_warm(args) -> dict:
+    """Задержка на изображение с холодной моделью (загрузка с диска + инференс) и с уже загруженной"""
+    image = synthetic_image(*args.size)
+    cold, warm = [], []
+    for _ in range(args.repeat):
+        models.clear()
+        start = time.perf_counter()
+        upscale_image(image, args.model, args.scale)
+        cold.append(time.perf_counter() - start)
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        upscale_image(image, args.model, args.scale)
+        warm.append(time.perf_counter() - start)
+    return {
+        'model': args.model,
+        'scale': args.scale,
+        'size': 'x'.join(map(str, args.size)),
+        'cold_ms': statistics.median(cold) * 1000,
+        'warm_ms': statistics.median(warm) * 1000,
+    }
+
+
+def tiled(args) -> dict:
+    """Полный кадр против тайлов: время и максимальное расхождение пикселей"""
+    image = synthetic_image(*args.size)
+    models.preload(args.model, args.scale)
+    start = time.perf_counter()
+    with models.borrow(args.model, args.scale) as scaler:
+        full = scaler.upsample(image)
+    full_time = time.perf_counter() - start
+    upscale_tiled(image, args.model, args.scale, args.tile, args.overlap)
+    start = time.perf_counter()
+    tiles = upscale_tiled(image, args.model, args.scale, args.tile, args.overlap)
+    tiled_time = time.perf_counter() - start
+    diff = np.abs(full.astype(np.int16) - tiles.astype(np.int16))
+    return {
+        'model': args.model,
+        'scale': args.scale,
+        'size': 'x'.join(map(str, args.size)),
+        'tile': args.tile,
+        'overlap': args.overlap,
+        'full_ms': full_time * 1000,
+        'tiled_ms': tiled_time * 1000,
+        'max_diff': int(diff.max()),
+        'mean_diff': float(diff.mean()),
+    }
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def batch(args) -> list[dict]:
+    """Пропускная способность и задержка батча при разных max_batch/max_wait.
+    clients потоков одновременно отправляют изображения, как задачи воркера с --pool threads"""
+    image = synthetic_image(*args.size)
+    report = []
+    for max_batch in args.max_batch:
+        for max_wait in args.max_wait:
+            upscaler = BatchUpscaler(args.model, args.scale, max_batch, max_wait / 1000)
+            upscaler.upscale(image)
+            upscaler.reset_stats()
+
+            def one(_):
+                start = time.perf_counter()
+                upscaler.upscale(image)
+                return time.perf_counter() - start
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(args.clients) as executor:
+                latencies = list(executor.map(one, range(args.images)))
+            elapsed = time.perf_counter() - start
+            report.append({
+                'max_batch': max_batch,
+                'max_wait_ms': max_wait,
+                'images_per_s': args.images / elapsed,
+                'p50_ms': percentile(latencies, 0.5) * 1000,
+                'p95_ms': percentile(latencies, 0.95) * 1000,
+                'mean_batch': upscaler.stats()['mean_batch'],
+            })
+    return report
+
+
+_worker_images = {}
+
+
+def init_matrix_worker(threads: int, model: str, scale: int):
+    cv2.setNumThreads(threads)
+    models.preload(model, scale)
+
+
+def matrix_job(job: tuple) -> tuple[float, int]:
+    """Один апскейл в процессе пула: задержка в секундах и пиковый RSS процесса в КиБ"""
+    size, model, scale = job
+    if size not in _worker_images:
+        _worker_images[size] = synthetic_image(*size)
+    start = time.perf_counter()
+    upscale_image(_worker_images[size], model, scale)
+    return time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def parse_model(value: str) -> tuple[str, int]:
+    model, _, scale = value.partition(':')
+    return model, int(scale or 2)
+
+
+def matrix(args) -> list[dict]:
+    """Перебор размеров, моделей, cv2.setNumThreads и числа процессов-воркеров.
+    Каждая ячейка - свой пул процессов (как воркеры Celery prefork), модели прогреты до замера.
+    Размеры больше TILE_SIZE идут через upscale_tiled: для них threads задает и размер пула тайлов"""
+    context = multiprocessing.get_context('spawn')
+    report = []
+    for size, (model, scale), threads, concurrency in itertools.product(
+            args.sizes, args.models, args.threads, args.concurrency):
+        # пул тайлов создается в процессе воркера по TILE_WORKERS, который читается при импорте upscale;
+        # каждому потоку тайлов нужна своя копия сети, иначе потоки сверх MAX_MODELS только ждут
+        os.environ['TILE_WORKERS'] = str(threads)
+        os.environ['MAX_MODELS'] = str(max(threads, MAX_MODELS))
+        with context.Pool(concurrency, init_matrix_worker, (threads, model, scale)) as pool:
+            # прогрев: по одному изображению на процесс
+            pool.map(matrix_job, [(size, model, scale)] * concurrency, chunksize=1)
+            start = time.perf_counter()
+            results = pool.map(matrix_job, [(size, model, scale)] * args.images, chunksize=1)
+            elapsed = time.perf_counter() - start
+        latencies = [latency for latency, _ in results]
+        report.append({
+            'size': 'x'.join(map(str, size)),
+            'model': model,
+            'scale': scale,
+            'threads': threads,
+            'tiled': bool(TILE_SIZE) and max(size) > TILE_SIZE,
+            'concurrency': concurrency,
+            'images_per_s': args.images / elapsed,
+            'p50_ms': percentile(latencies, 0.5) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'peak_rss_mb': max(rss for _, rss in results) / 1024,
+        })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарки апскейла')
+    parser.add_argument('--output', help='записать JSON в файл вместо stdout')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('cold-warm', help='холодная и прогретая модель')
+    command.add_argument('--model', default='edsr')
+    command.add_argument('--scale', type=int, default=2)
+    command.add_argument('--size', type=parse_size, default=(300, 300))
+    command.add_argument('--repeat', type=int, default=5)
+    command.set_defaults(func=cold_warm)
+
+    command = commands.add_parser('tiled', help='полный кадр против тайлов')
+    command.add_argument('--model', default='edsr')
+    command.add_argument('--scale', type=int, default=2)
+    command.add_argument('--size', type=parse_size, default=(1024, 768))
+    command.add_argument('--tile', type=int, default=256)
+    command.add_argument('--overlap', type=int, default=16)
+    command.set_defaults(func=tiled)
+
+    command = commands.add_parser('batch', help='батч: пропускная способность против задержки')
+    command.add_argument('--model', default='edsr')
+    command.add_argument('--scale', type=int, default=2)
+    command.add_argument('--size', type=parse_size, default=(128, 128))
+    command.add_argument('--max-batch', type=int, nargs='+', default=[1, 2, 4, 8])
+    command.add_argument('--max-wait', type=float, nargs='+', default=[5, 20, 50], help='мс')
+    command.add_argument('--clients', type=int, default=8)
+    command.add_argument('--images', type=int, default=64)
+    command.set_defaults(func=batch)
+
+    command = commands.add_parser('matrix', help='матрица размеров, моделей, потоков и воркеров')
+    command.add_argument('--sizes', type=parse_size, nargs='+', default=[(256, 256), (512, 512), (1024, 1024)])
+    command.add_argument('--models', type=parse_model, nargs='+', default=[('edsr', 2)], help='model:scale')
+    command.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4])
+    command.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4])
+    command.add_argument('--images', type=int, default=16, help='изображений на ячейку')
+    command.set_defaults(func=matrix)
+
+    args = parser.parse_args()
+    report = json.dumps(args.func(args), indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(report)
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
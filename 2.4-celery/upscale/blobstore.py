@@ -0,0 +1,88 @@
+import fcntl
+import mmap
+import os
+import struct
+import time
+import uuid
+
+import numpy as np
+
+# tmpfs-каталог, общий для веб-процесса и воркеров на одной машине
+BLOB_DIR = os.getenv('BLOB_DIR', '/dev/shm/upscale')
+# блобы старше BLOB_TTL секунд считаются брошенными (например, воркер упал) и удаляются.
+# Задача с блобом истекает в очереди раньше (BLOB_TASK_EXPIRES), поэтому к этому времени ее блоб
+# либо уже загружен воркером, либо освобожден обработчиком отмены
+BLOB_TTL = int(os.getenv('BLOB_TTL', 60 * 60))
+BLOB_TASK_EXPIRES = int(os.getenv('BLOB_TASK_EXPIRES', BLOB_TTL // 2))
+if not 0 < BLOB_TASK_EXPIRES < BLOB_TTL:
+    raise ValueError('BLOB_TASK_EXPIRES must be positive and less than BLOB_TTL')
+SWEEP_INTERVAL = 60
+
+HEADER = struct.Struct('<q')
+
+
+class SharedBlobStore:
+    """Изображения в разделяемой памяти: веб-процесс пишет загрузку один раз, в сообщении задачи идет только
+    handle, воркер отображает файл в память и читает его как массив numpy без копирования.
+    Первые 8 байт блоба - счетчик ссылок, изменяется под flock; на нуле блоб удаляется."""
+
+    def __init__(self, directory: str = BLOB_DIR, ttl: int = BLOB_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        self._last_sweep = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, handle: str) -> str:
+        return os.path.join(self.directory, os.path.basename(handle))
+
+    def put(self, data, refs: int = 1) -> str:
+        """Записывает данные (bytes, memoryview, массив numpy) и возвращает handle с refs ссылками"""
+        self.sweep()
+        handle = uuid.uuid4().hex
+        fd = os.open(self.path(handle), os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600)
+        with open(fd, 'wb') as file:
+            file.write(HEADER.pack(refs))
+            file.write(data)
+        return handle
+
+    def _add_ref(self, handle: str, delta: int) -> int:
+        path = self.path(handle)
+        with open(path, 'r+b') as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            refs = HEADER.unpack(file.read(HEADER.size))[0] + delta
+            file.seek(0)
+            file.write(HEADER.pack(refs))
+            file.flush()
+            if refs <= 0:
+                os.remove(path)
+        return refs
+
+    def acquire(self, handle: str) -> int:
+        return self._add_ref(handle, 1)
+
+    def release(self, handle: str) -> int:
+        try:
+            return self._add_ref(handle, -1)
+        except FileNotFoundError:
+            return 0
+
+    def load(self, handle: str) -> np.ndarray:
+        """Массив uint8 только для чтения поверх отображенного файла. Отображение снимается, когда массив
+        собран сборщиком мусора, поэтому release можно вызывать сразу: данные останутся доступны"""
+        with open(self.path(handle), 'rb') as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return np.frombuffer(mapped, dtype=np.uint8, offset=HEADER.size)
+
+    def sweep(self) -> None:
+        """Удаляет блобы старше ttl. Счетчик ссылок не проверяется: живая задача загружает блоб
+        не позже BLOB_TASK_EXPIRES после отправки, дальше данные держит отображение в памяти"""
+        now = time.time()
+        if now - self._last_sweep < SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.is_file() and now - entry.stat().st_mtime > self.ttl:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
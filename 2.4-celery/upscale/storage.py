@@ -0,0 +1,102 @@
+import os
+import threading
+
+RESULT_STORE = os.getenv('RESULT_STORE', 'disk')
+RESULT_DIR = os.getenv('RESULT_DIR', 'processed')
+# предельный размер каталога результатов в байтах, 0 - без ограничения
+RESULT_DIR_MAX_SIZE = int(os.getenv('RESULT_DIR_MAX_SIZE', 1024 ** 3))
+
+
+class MemoryResultStore:
+    """Результаты в памяти процесса. Подходит, когда задачи выполняются в том же процессе
+    (task_always_eager, тесты), между веб-процессом и воркером не разделяется."""
+
+    def __init__(self):
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def save(self, name: str, data) -> None:
+        with self._lock:
+            self._items[name] = bytes(data)
+
+    def get(self, name: str):
+        with self._lock:
+            return self._items.get(name)
+
+    def exists(self, name: str) -> bool:
+        with self._lock:
+            return name in self._items
+
+    def delete(self, name: str) -> None:
+        with self._lock:
+            self._items.pop(name, None)
+
+
+class DiskResultStore:
+    """Результаты в локальном каталоге, общем для веб-процесса и воркеров.
+    Если каталог вырос больше max_size, удаляются файлы, которые дольше всех не читали (LRU по mtime)."""
+
+    def __init__(self, directory: str = RESULT_DIR, max_size: int = RESULT_DIR_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, name: str) -> str:
+        # имя приходит из URL, поэтому отрезаем любые каталоги
+        return os.path.join(self.directory, os.path.basename(name))
+
+    def save(self, name: str, data) -> None:
+        # пишем во временный файл и переименовываем, чтобы читатель не увидел недописанный результат
+        path = self.path(name)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as file:
+            file.write(data)
+        os.replace(tmp_path, path)
+        if self.max_size:
+            self.evict()
+
+    def get(self, name: str):
+        path = self.path(name)
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            return None
+        # чтение продлевает жизнь файла в кэше
+        os.utime(path)
+        return data
+
+    def exists(self, name: str) -> bool:
+        return os.path.exists(self.path(name))
+
+    def delete(self, name: str) -> None:
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
+
+    def evict(self) -> None:
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+RESULT_STORES = {
+    'memory': MemoryResultStore,
+    'disk': DiskResultStore,
+}
+
+
+def get_result_store(kind: str = RESULT_STORE):
+    return RESULT_STORES[kind]()
@@ -0,0 +1,190 @@
+import hashlib
+import os
+import uuid
+
+from celery import Celery
+from celery.exceptions import Ignore
+from celery.signals import task_revoked, worker_process_init
+from kombu import Queue
+from redis.exceptions import WatchError
+
+from batching import upscale_batched
+from blobstore import SharedBlobStore, BLOB_TASK_EXPIRES
+from storage import get_result_store
+from upscale import models, upscale_bytes
+
+CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://127.0.0.1:6379/0')
+CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', 'redis://127.0.0.1:6379/1')
+DEFAULT_MODEL = os.getenv('DEFAULT_MODEL', 'edsr')
+DEFAULT_SCALE = int(os.getenv('DEFAULT_SCALE', 2))
+# изображения до SMALL_IMAGE_PIXELS пикселей идут в очередь upscale_small, остальные - в upscale_large;
+# воркеры запускаются отдельно на каждую очередь: celery -A tasks worker -Q upscale_small
+SMALL_IMAGE_PIXELS = int(os.getenv('SMALL_IMAGE_PIXELS', 1024 * 1024))
+LARGE_IMAGE_PIXELS = int(os.getenv('LARGE_IMAGE_PIXELS', 16 * 1024 * 1024))
+# shm - изображение лежит в разделяемой памяти и в сообщении идет только handle (веб и воркеры на одной машине),
+# broker - байты изображения передаются в самом сообщении
+BLOB_TRANSPORT = os.getenv('BLOB_TRANSPORT', 'shm')
+# сколько секунд держится отметка задачи, считающей ключ: ограничивает отметку задачи, которая так и не завершилась
+INFLIGHT_TTL = int(os.getenv('INFLIGHT_TTL', 60 * 60))
+
+celery_app = Celery('upscale', broker=CELERY_BROKER_URL, backend=CELERY_RESULT_BACKEND)
+celery_app.conf.update(
+    # только json: pickle из брокера позволил бы любому, кто может писать в очередь, выполнить код на воркере.
+    # При BLOB_TRANSPORT=shm в сообщении только handle, при broker kombu кодирует bytes в base64
+    task_serializer='json',
+    accept_content=['json'],
+    result_serializer='json',
+    task_track_started=True,
+    task_always_eager=os.getenv('CELERY_TASK_ALWAYS_EAGER') == '1',
+    task_store_eager_result=True,
+    task_queues=(Queue('upscale_small'), Queue('upscale_large')),
+    task_default_queue='upscale_small',
+    # в Redis меньший номер приоритета забирается раньше
+    broker_transport_options={'queue_order_strategy': 'priority', 'priority_steps': list(range(10))},
+    worker_prefetch_multiplier=1,
+)
+
+result_store = get_result_store()
+blob_store = SharedBlobStore() if BLOB_TRANSPORT == 'shm' else None
+
+# состояния задачи, при которых новая загрузка того же изображения присоединяется к ней
+IN_FLIGHT_STATES = {'SENT', 'RECEIVED', 'STARTED', 'PROGRESS', 'RETRY'}
+
+
+def content_key(data, ext: str, model: str, scale: int) -> str:
+    """Адрес результата по содержимому: одинаковые байты с теми же параметрами дают тот же ключ"""
+    digest = hashlib.sha256(f'{model}:{scale}:{ext}:'.encode())
+    digest.update(data)
+    return f'{digest.hexdigest()}{ext}'
+
+
+def inflight_key(key: str) -> str:
+    return f'upscale-inflight-{key}'
+
+
+def claim_inflight(key: str, task_id: str) -> str | None:
+    """Атомарно (SET NX) отмечает task_id задачей, которая считает результат для ключа key.
+    Если ключ уже считает другая задача, возвращает ее id, иначе None. Отметку завершившейся задачи
+    снимает, только если ее не успела заменить другая загрузка (WATCH)"""
+    client = celery_app.backend.client
+    name = inflight_key(key)
+    while True:
+        if client.set(name, task_id, nx=True, ex=INFLIGHT_TTL):
+            return None
+        with client.pipeline() as pipe:
+            try:
+                pipe.watch(name)
+                holder = pipe.get(name)
+                if holder is None:
+                    continue
+                holder = holder.decode()
+                if celery_app.AsyncResult(holder).state in IN_FLIGHT_STATES:
+                    return holder
+                pipe.multi()
+                pipe.delete(name)
+                pipe.execute()
+            except WatchError:
+                continue
+
+
+def route(pixels: int) -> dict:
+    """Очередь и приоритет задачи по размеру изображения: маленькие не ждут за большими"""
+    queue = 'upscale_small' if pixels <= SMALL_IMAGE_PIXELS else 'upscale_large'
+    priority = min(9, pixels * 10 // LARGE_IMAGE_PIXELS)
+    return {'queue': queue, 'priority': priority}
+
+
+def submit(data, ext: str, model: str, scale: int, key: str, pixels: int) -> tuple[str, bool]:
+    """Ставит задачу для ключа key, если его еще никто не считает. Возвращает id задачи и True,
+    если задача новая, или id уже считающей задачи и False: тогда ничего не публикуется"""
+    # Celery не отличает отправленную задачу от неизвестной (обе PENDING), поэтому отправку отмечаем сами.
+    # SENT пишется до отметки ключа, чтобы параллельная загрузка видела ее задачу в полете, и до публикации:
+    # после нее быстрый воркер мог бы успеть записать STARTED или SUCCESS, и SENT затер бы его.
+    # id задач случайные: отмененный id остается в списке revoked воркеров
+    task_id = str(uuid.uuid4())
+    celery_app.backend.store_result(task_id, None, 'SENT')
+    holder = claim_inflight(key, task_id)
+    if holder is not None:
+        celery_app.backend.forget(task_id)
+        return holder, False
+    kwargs = {}
+    try:
+        if blob_store is not None:
+            # единственная копия загрузки: из буфера запроса в разделяемую память
+            args, kwargs = (None, ext, model, scale, key), {'blob': blob_store.put(data)}
+            # не дожидается в очереди удаления блоба по TTL: истекшая задача освобождает блоб в release_revoked_blob
+            expires = BLOB_TASK_EXPIRES
+        else:
+            args = (bytes(data), ext, model, scale, key)
+            expires = None
+        upscale_task.apply_async(args, kwargs, task_id=task_id, expires=expires, **route(pixels))
+    except Exception:
+        celery_app.backend.client.delete(inflight_key(key))
+        celery_app.backend.forget(task_id)
+        if kwargs:
+            blob_store.release(kwargs['blob'])
+        raise
+    return task_id, True
+
+
+def cancel_key(task_id: str) -> str:
+    return f'upscale-cancel-{task_id}'
+
+
+def is_cancelled(task_id: str) -> bool:
+    return celery_app.backend.get(cancel_key(task_id)) is not None
+
+
+def cancel(task_id: str) -> None:
+    """Снимает задачу из очереди, а выполняющуюся останавливает после текущего тайла.
+    Список revoked есть только у главного процесса воркера, дочерний процесс prefork его не видит,
+    а состояние REVOKED затирается следующим PROGRESS, поэтому отмена - отдельный ключ в бэкенде"""
+    celery_app.backend.set(cancel_key(task_id), '1')
+    celery_app.control.revoke(task_id)
+    celery_app.backend.mark_as_revoked(task_id, reason='cancelled')
+
+
+@worker_process_init.connect
+def preload_model(**kwargs):
+    """Модель по умолчанию загружается при старте процесса воркера, а не на первой задаче"""
+    models.preload(DEFAULT_MODEL, DEFAULT_SCALE)
+
+
+@task_revoked.connect
+def release_revoked_blob(request=None, **kwargs):
+    """Отмененная или истекшая (expires) задача из очереди не выполняется, поэтому ее блоб освобождаем здесь"""
+    blob = (request.kwargs or {}).get('blob') if request is not None else None
+    if blob is not None and blob_store is not None:
+        blob_store.release(blob)
+
+
+@celery_app.task(name='upscale', bind=True)
+def upscale_task(self, data: bytes | None, ext: str = '.png', model: str = DEFAULT_MODEL, scale: int = DEFAULT_SCALE,
+                 key: str | None = None, blob: str | None = None) -> str:
+    """Апскейлит закодированное изображение и кладет результат в хранилище под ключом содержимого,
+    возвращает имя файла. Прогресс публикуется состоянием PROGRESS с meta {'done', 'total'}.
+    Изображение приходит байтами в data или handle блоба в разделяемой памяти в blob"""
+
+    def check_cancelled():
+        if is_cancelled(self.request.id):
+            # REVOKED пишется заново: отмена могла прийти между проверкой и предыдущим PROGRESS
+            self.backend.mark_as_revoked(self.request.id, reason='cancelled')
+            raise Ignore()
+
+    def progress(done: int, total: int):
+        check_cancelled()
+        self.update_state(state='PROGRESS', meta={'done': done, 'total': total})
+
+    if blob is not None:
+        data = blob_store.load(blob)
+    try:
+        result = upscale_bytes(data, ext, model, scale, upscale_batched, progress)
+    finally:
+        if blob is not None:
+            # ссылка сообщения больше не нужна: изображение декодировано, отображение снимется вместе с data
+            blob_store.release(blob)
+    # иначе SUCCESS затер бы REVOKED отмены, пришедшей после последнего тайла
+    check_cancelled()
+    file_name = key or f'{self.request.id}{ext}'
+    result_store.save(file_name, result)
+    return file_name
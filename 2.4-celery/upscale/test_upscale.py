@@ -0,0 +1,192 @@
+import os
+import threading
+import time
+import unittest
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import cv2
+import numpy as np
+
+import tasks
+import upscale
+from bench import synthetic_image
+
+
+def redis_available() -> bool:
+    try:
+        return tasks.celery_app.backend.client.ping()
+    except Exception:
+        return False
+
+
+class BicubicModel:
+    """Замена сети для тестов: бикубическое увеличение, результат зависит от соседей пикселя, как у сети"""
+
+    def __init__(self, scale: int):
+        self.scale = scale
+
+    def upsample(self, image: np.ndarray) -> np.ndarray:
+        return cv2.resize(image, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_CUBIC)
+
+
+class ExclusiveModel(BicubicModel):
+    """Бикубика, которая запоминает, если ее вызвали из двух потоков одновременно"""
+
+    def __init__(self, scale: int):
+        super().__init__(scale)
+        self.lock = threading.Lock()
+        self.shared = False
+
+    def upsample(self, image: np.ndarray) -> np.ndarray:
+        if not self.lock.acquire(blocking=False):
+            self.shared = True
+            self.lock.acquire()
+        try:
+            time.sleep(0.005)
+            return super().upsample(image)
+        finally:
+            self.lock.release()
+
+
+class TiledUpscaleTest(unittest.TestCase):
+    # на границах тайлов бикубика видит продолженный край вместо соседей, смешивание перекрытия это сглаживает
+    MAX_DIFF = 4
+
+    def setUp(self):
+        patcher = mock.patch.object(upscale, 'load_model', lambda model, scale, model_dir='.': BicubicModel(scale))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assert_matches_full_frame(self, image: np.ndarray, scale: int, tile: int, overlap: int):
+        full = BicubicModel(scale).upsample(image)
+        tiled = upscale.upscale_tiled(image, 'espcn', scale, tile=tile, overlap=overlap)
+        self.assertEqual(tiled.shape, full.shape)
+        diff = np.abs(tiled.astype(np.int16) - full.astype(np.int16))
+        self.assertLessEqual(int(diff.max()), self.MAX_DIFF)
+
+    def test_tiled_matches_full_frame(self):
+        # размеры не кратны шагу тайла: последний ряд и столбец прижаты к краю
+        self.assert_matches_full_frame(synthetic_image(200, 150), scale=2, tile=64, overlap=16)
+
+    def test_tiled_matches_full_frame_grayscale(self):
+        image = cv2.cvtColor(synthetic_image(130, 97, seed=1), cv2.COLOR_BGR2GRAY)
+        self.assert_matches_full_frame(image, scale=3, tile=48, overlap=8)
+
+    def test_single_tile_is_exact(self):
+        image = synthetic_image(40, 30)
+        tiled = upscale.upscale_tiled(image, 'espcn', 2, tile=64, overlap=16)
+        np.testing.assert_array_equal(tiled, BicubicModel(2).upsample(image))
+
+    def test_progress_reports_every_tile(self):
+        # 112 = 64 + 48: два тайла по каждой стороне
+        calls = []
+        upscale.upscale_tiled(synthetic_image(112, 112), 'espcn', 2, tile=64, overlap=16,
+                              progress=lambda done, total: calls.append((done, total)))
+        self.assertEqual(calls, [(1, 4), (2, 4), (3, 4), (4, 4)])
+
+
+class ModelFromPathTest(unittest.TestCase):
+    """Прежний параметр model_path upscale() отображается на модель из MODEL_DIR"""
+
+    def setUp(self):
+        patcher = mock.patch.object(upscale, 'models', upscale.ModelRegistry(model_dir='.'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_model_file_in_model_dir(self):
+        # прежнее значение по умолчанию и тот же каталог, записанный по-другому
+        self.assertEqual(upscale.model_from_path('EDSR_x2.pb'), ('edsr', 2))
+        self.assertEqual(upscale.model_from_path(os.path.join(os.getcwd(), 'LapSRN_x8.pb')), ('lapsrn', 8))
+
+    def test_unknown_model_file(self):
+        for path in ('EDSR_x5.pb', 'model.onnx', '/nonexistent/EDSR_x2.pb'):
+            with self.subTest(path=path), self.assertRaises(ValueError):
+                upscale.model_from_path(path)
+
+    def test_upscale_accepts_model_path(self):
+        with mock.patch.object(upscale, 'upscale_image') as upscale_image, \
+                mock.patch.object(upscale.cv2, 'imread'), mock.patch.object(upscale.cv2, 'imwrite'):
+            upscale.upscale('in.png', 'out.png', 'FSRCNN_x3.pb')
+        self.assertEqual(upscale_image.call_args.args[1:], ('fsrcnn', 3))
+
+
+class ModelRegistryTest(unittest.TestCase):
+    """Копии сетей общие для потоков тайлов: всего не больше max_models, копия одновременно у одного потока"""
+
+    def setUp(self):
+        self.loaded = []
+
+        def load_model(model, scale, model_dir='.'):
+            self.loaded.append(ExclusiveModel(scale))
+            return self.loaded[-1]
+
+        executor = ThreadPoolExecutor(4)
+        self.addCleanup(executor.shutdown)
+        for patcher in (mock.patch.object(upscale, 'load_model', load_model),
+                        mock.patch.object(upscale, 'models', upscale.ModelRegistry(max_models=2)),
+                        mock.patch.object(upscale, '_tile_executor', executor),
+                        mock.patch.object(upscale, 'TILE_WORKERS', 4)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_tile_threads_share_bounded_copies(self):
+        image = synthetic_image(200, 200)
+        tiled = upscale.upscale_tiled(image, 'espcn', 2, tile=64, overlap=16)
+        self.assertEqual(tiled.shape, (400, 400, 3))
+        self.assertEqual(len(self.loaded), 2)
+        self.assertFalse(any(scaler.shared for scaler in self.loaded))
+
+    def test_other_model_is_evicted_at_cap(self):
+        registry = upscale.ModelRegistry(max_models=1)
+        for scale in (2, 3, 2):
+            with registry.borrow('espcn', scale) as scaler:
+                self.assertEqual(scaler.scale, scale)
+        self.assertEqual(len(self.loaded), 3)
+        with registry.borrow('espcn', 2):
+            pass
+        self.assertEqual(len(self.loaded), 3)
+
+
+@unittest.skipUnless(redis_available(), 'нужен Redis бэкенда Celery (CELERY_RESULT_BACKEND)')
+class ConcurrentSubmitTest(unittest.TestCase):
+    """Одновременные загрузки одного изображения ставят одну задачу, остальные получают ее id"""
+
+    THREADS = 10
+
+    def setUp(self):
+        self.key = f'test-{uuid.uuid4().hex}.png'
+        self.addCleanup(tasks.celery_app.backend.client.delete, tasks.inflight_key(self.key))
+        for patcher in (mock.patch.object(tasks, 'blob_store', None),
+                        mock.patch.object(tasks.upscale_task, 'apply_async')):
+            self.apply_async = patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_concurrent_submits_send_one_task(self):
+        barrier = threading.Barrier(self.THREADS)
+        results, errors = [], []
+
+        def worker():
+            try:
+                barrier.wait()
+                results.append(tasks.submit(b'image', '.png', 'espcn', 2, self.key, 100))
+            except Exception as err:
+                errors.append(err)
+
+        threads = [threading.Thread(target=worker) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.apply_async.assert_called_once()
+        task_id = self.apply_async.call_args.kwargs['task_id']
+        self.addCleanup(tasks.celery_app.backend.forget, task_id)
+        self.assertEqual(sorted(created for _, created in results), [False] * (self.THREADS - 1) + [True])
+        self.assertEqual({result_id for result_id, _ in results}, {task_id})
+
+
+if __name__ == '__main__':
+    unittest.main()
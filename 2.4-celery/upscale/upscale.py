@@ -1,20 +1,294 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
 import cv2
+import numpy as np
 from cv2 import dnn_superres
 
+MODEL_DIR = os.getenv('MODEL_DIR', '.')
+# сколько копий моделей держать в памяти процесса одновременно, включая копии потоков тайлов
+MAX_MODELS = int(os.getenv('MAX_MODELS', 2))
+MODEL_FILES = {
+    'edsr': 'EDSR_x{scale}.pb',
+    'espcn': 'ESPCN_x{scale}.pb',
+    'fsrcnn': 'FSRCNN_x{scale}.pb',
+    'lapsrn': 'LapSRN_x{scale}.pb',
+}
+# изображения больше TILE_SIZE по любой стороне обрабатываются тайлами (0 - никогда)
+TILE_SIZE = int(os.getenv('TILE_SIZE', 512))
+TILE_OVERLAP = int(os.getenv('TILE_OVERLAP', 16))
+TILE_WORKERS = int(os.getenv('TILE_WORKERS', 1))
+MODEL_SCALES = {
+    'edsr': (2, 3, 4),
+    'espcn': (2, 3, 4),
+    'fsrcnn': (2, 3, 4),
+    'lapsrn': (2, 4, 8),
+}
+
+
+def load_model(model: str, scale: int, model_dir: str = MODEL_DIR):
+    if scale not in MODEL_SCALES.get(model, ()):
+        raise ValueError(f'unknown model {model} x{scale}')
+    scaler = dnn_superres.DnnSuperResImpl_create()
+    scaler.readModel(os.path.join(model_dir, MODEL_FILES[model].format(scale=scale)))
+    scaler.setModel(model, scale)
+    return scaler
+
+
+class ModelRegistry:
+    """Загруженные сети процесса: не больше max_models копий на все (model, scale) вместе.
+    Сеть OpenCV нельзя вызывать из нескольких потоков одновременно, поэтому копия выдается одному потоку
+    на время borrow. Параллельному потоку грузится еще одна копия, пока есть место, иначе выгружается
+    самая давняя свободная копия другой модели, а если свободных нет - поток ждет, пока копию вернут."""
+
+    def __init__(self, max_models: int = MAX_MODELS, model_dir: str = MODEL_DIR):
+        if max_models < 1:
+            raise ValueError('max_models must be positive')
+        self.max_models = max_models
+        self.model_dir = model_dir
+        # свободные копии [(key, scaler)], от давно до недавно возвращенных
+        self._idle = []
+        self._loaded = 0
+        self._condition = threading.Condition()
+
+    def _take(self, key) -> object | None:
+        """Свободная копия key или None, если под key можно загрузить новую; вызывается под _condition"""
+        while True:
+            for index in range(len(self._idle) - 1, -1, -1):
+                if self._idle[index][0] == key:
+                    return self._idle.pop(index)[1]
+            if self._loaded < self.max_models:
+                self._loaded += 1
+                return None
+            if self._idle:
+                del self._idle[0]
+                self._loaded -= 1
+                continue
+            self._condition.wait()
+
+    @contextmanager
+    def borrow(self, model: str = 'edsr', scale: int = 2):
+        key = (model, scale)
+        with self._condition:
+            scaler = self._take(key)
+        if scaler is None:
+            try:
+                scaler = load_model(model, scale, self.model_dir)
+            except BaseException:
+                with self._condition:
+                    self._loaded -= 1
+                    self._condition.notify()
+                raise
+        try:
+            yield scaler
+        finally:
+            with self._condition:
+                self._idle.append((key, scaler))
+                self._condition.notify()
+
+    def preload(self, model: str = 'edsr', scale: int = 2) -> None:
+        """Загружает копию модели заранее, чтобы первая задача не читала ее с диска"""
+        with self.borrow(model, scale):
+            pass
+
+    def clear(self):
+        with self._condition:
+            self._loaded -= len(self._idle)
+            self._idle.clear()
+
+
+models = ModelRegistry()
+
+# Тайлы одного изображения считаются в пуле TILE_WORKERS потоков, каждый берет из models свою копию сети.
+# cv2.setNumThreads действует на весь процесс, а каждый forward и так параллелится OpenCV на все ядра,
+# поэтому по умолчанию тайлы идут по одному: TILE_WORKERS потоков умножали бы потоки OpenCV.
+# Больше одного потока имеет смысл вместе с cv2.setNumThreads(ядра // TILE_WORKERS) и MAX_MODELS >= TILE_WORKERS.
+# Пул живет все время работы процесса
+_tile_executor = None
+_tile_executor_lock = threading.Lock()
+
+
+def get_tile_executor() -> ThreadPoolExecutor:
+    global _tile_executor
+    with _tile_executor_lock:
+        if _tile_executor is None:
+            _tile_executor = ThreadPoolExecutor(TILE_WORKERS, thread_name_prefix='upscale-tile')
+        return _tile_executor
+
+
+def tile_starts(length: int, tile: int, overlap: int) -> list[int]:
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile + 1, tile - overlap))
+    if starts[-1] + tile < length:
+        starts.append(length - tile)
+    return starts
+
+
+def blend_ramp(length: int, overlap: int) -> np.ndarray:
+    """Вес тайла вдоль оси: линейно растет от 0 до 1 на первых overlap пикселях"""
+    ramp = np.ones(length, dtype=np.float32)
+    if overlap > 0:
+        ramp[:overlap] = np.linspace(0, 1, overlap + 2, dtype=np.float32)[1:-1]
+    return ramp
+
+
+def blend_strip(target: np.ndarray, source: np.ndarray, weight: np.ndarray) -> None:
+    if target.ndim == 3:
+        weight = weight[..., None]
+    target[...] = np.rint(target * (1 - weight) + source * weight).astype(target.dtype)
+
+
+def upscale_tile(tile: np.ndarray, model: str, scale: int) -> np.ndarray:
+    with models.borrow(model, scale) as scaler:
+        return scaler.upsample(tile)
 
-def upscale(input_path: str, output_path: str, model_path: str = 'EDSR_x2.pb') -> None:
+
+def upscale_tiled(image: np.ndarray, model: str = 'edsr', scale: int = 2,
+                  tile: int = TILE_SIZE, overlap: int = TILE_OVERLAP, progress=None) -> np.ndarray:
+    """
+    Апскейл по перекрывающимся тайлам tile x tile в пуле потоков.
+    Тайлы вклеиваются по порядку строк, перекрытие с уже вклеенными соседями сверху и слева
+    смешивается линейно, поэтому кроме результата в памяти одновременно только несколько тайлов.
+    :param image: декодированное изображение (BGR)
+    :param model: название ИИ модели
+    :param scale: во сколько раз увеличить
+    :param tile: сторона тайла во входных пикселях
+    :param overlap: перекрытие соседних тайлов во входных пикселях
+    :param progress: необязательный вызов progress(done, total) после каждого тайла
+    :return: увеличенное изображение
+    """
+
+    if not 0 <= overlap < tile:
+        raise ValueError('overlap must be in [0, tile)')
+    height, width = image.shape[:2]
+    result = np.empty((height * scale, width * scale) + image.shape[2:], dtype=image.dtype)
+    boxes = [(y, x) for y in tile_starts(height, tile, overlap) for x in tile_starts(width, tile, overlap)]
+
+    executor = get_tile_executor()
+    # в работе не больше двух тайлов на поток, чтобы не держать в памяти все результаты сразу
+    window = TILE_WORKERS * 2
+    futures = [executor.submit(upscale_tile, image[y:y + tile, x:x + tile], model, scale) for y, x in boxes[:window]]
+    for index, (y, x) in enumerate(boxes):
+        upscaled = futures[index].result()
+        futures[index] = None
+        if index + window < len(boxes):
+            next_y, next_x = boxes[index + window]
+            futures.append(executor.submit(upscale_tile, image[next_y:next_y + tile, next_x:next_x + tile], model, scale))
+
+        out_y, out_x = y * scale, x * scale
+        out_h, out_w = upscaled.shape[:2]
+        region = result[out_y:out_y + out_h, out_x:out_x + out_w]
+        # перекрытие есть только с тайлами выше и левее, которые уже вклеены;
+        # смешиваются только эти полосы, остальное копируется как есть
+        blend_h = min(overlap * scale, out_h) if y > 0 else 0
+        blend_w = min(overlap * scale, out_w) if x > 0 else 0
+        region[blend_h:, blend_w:] = upscaled[blend_h:, blend_w:]
+        weight_x = blend_ramp(out_w, blend_w)
+        if blend_h:
+            weight = np.outer(blend_ramp(blend_h, blend_h), weight_x)
+            blend_strip(region[:blend_h], upscaled[:blend_h], weight)
+        if blend_w:
+            weight = np.broadcast_to(weight_x[:blend_w], (out_h - blend_h, blend_w))
+            blend_strip(region[blend_h:, :blend_w], upscaled[blend_h:, :blend_w], weight)
+        if progress is not None:
+            progress(index + 1, len(boxes))
+    return result
+
+
+def upscale_image(image: np.ndarray, model: str = 'edsr', scale: int = 2, progress=None) -> np.ndarray:
+    """
+    :param image: декодированное изображение (BGR)
+    :param model: название ИИ модели
+    :param scale: во сколько раз увеличить
+    :param progress: необязательный вызов progress(done, total), для тайлов - после каждого тайла
+    :return: увеличенное изображение
+    """
+
+    if TILE_SIZE and max(image.shape[:2]) > TILE_SIZE:
+        return upscale_tiled(image, model, scale, progress=progress)
+    with models.borrow(model, scale) as scaler:
+        result = scaler.upsample(image)
+    if progress is not None:
+        progress(1, 1)
+    return result
+
+
+def image_size(data) -> tuple[int, int]:
+    """Ширина и высота закодированного изображения. PNG и JPEG читаются по заголовку без декодирования,
+    остальные форматы декодируются в 8 раз уменьшенными, поэтому размер для них приблизительный"""
+    data = memoryview(data)
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and data[12:16] == b'IHDR':
+        return int.from_bytes(data[16:20], 'big'), int.from_bytes(data[20:24], 'big')
+    if data[:2] == b'\xff\xd8':
+        position = 2
+        while position + 9 < len(data):
+            if data[position] != 0xff:
+                break
+            marker = data[position + 1]
+            length = int.from_bytes(data[position + 2:position + 4], 'big')
+            # SOF0..SOF15 кроме DHT (c4), JPG (c8) и DAC (cc)
+            if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+                height = int.from_bytes(data[position + 5:position + 7], 'big')
+                width = int.from_bytes(data[position + 7:position + 9], 'big')
+                return width, height
+            position += 2 + length
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if image is None:
+        raise ValueError('cannot decode image')
+    return image.shape[1] * 8, image.shape[0] * 8
+
+
+def upscale_bytes(data, ext: str = '.png', model: str = 'edsr', scale: int = 2,
+                  upscale_func=upscale_image, progress=None) -> np.ndarray:
+    """
+    :param data: закодированное изображение (bytes, memoryview и т.п.), файлы на диск не пишутся
+    :param ext: формат результата
+    :param model: название ИИ модели
+    :param scale: во сколько раз увеличить
+    :param upscale_func: функция апскейла декодированного изображения (например, через батч)
+    :param progress: необязательный вызов progress(done, total)
+    :return: закодированный результат, буфер numpy без лишнего копирования в bytes
+    """
+
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError('cannot decode image')
+    ok, encoded = cv2.imencode(ext, upscale_func(image, model, scale, progress))
+    if not ok:
+        raise ValueError(f'cannot encode image as {ext}')
+    return encoded
+
+
+def model_from_path(model_path: str) -> tuple[str, int]:
+    """(model, scale) по пути к файлу модели вида MODEL_DIR/EDSR_x2.pb, чтобы загрузить его через models"""
+    directory, name = os.path.split(model_path)
+    if os.path.realpath(directory or '.') != os.path.realpath(models.model_dir):
+        raise ValueError(f'model_path must be in MODEL_DIR {models.model_dir}')
+    for model, scales in MODEL_SCALES.items():
+        for scale in scales:
+            if name == MODEL_FILES[model].format(scale=scale):
+                return model, scale
+    raise ValueError(f'unknown model file {name}')
+
+
+def upscale(input_path: str, output_path: str, model_path: str | None = None,
+            model: str = 'edsr', scale: int = 2) -> None:
     """
     :param input_path: путь к изображению для апскейла
     :param output_path:  путь к выходному файлу
-    :param model_path: путь к ИИ модели
+    :param model_path: путь к ИИ модели (прежний параметр), задает model и scale по имени файла в MODEL_DIR
+    :param model: название ИИ модели, файл модели ищется в MODEL_DIR
+    :param scale: во сколько раз увеличить
     :return:
     """
 
-    scaler = dnn_superres.DnnSuperResImpl_create()
-    scaler.readModel(model_path)
-    scaler.setModel("edsr", 2)
+    if model_path is not None:
+        model, scale = model_from_path(model_path)
     image = cv2.imread(input_path)
-    result = scaler.upsample(image)
+    result = upscale_image(image, model, scale)
     cv2.imwrite(output_path, result)
 
 
@@ -23,4 +297,4 @@ def example():
 
 
 if __name__ == '__main__':
-    example()
\ No newline at end of file
+    example()